@@ -147,38 +147,57 @@ class AbstractGridEngineBatchSystem(BatchSystemCleanupSupport):
                 self.boss.config.max_jobs
             ):
                 activity = True
-                jobID, cpu, memory, command, jobName, environment, gpus = (
-                    self.waitingJobs.pop(0)
-                )
-                if self.boss.config.memory_is_product and cpu > 1:
-                    memory = memory // cpu
-                # prepare job submission command
-                subLine = self.prepareSubmission(
-                    cpu, memory, jobID, command, jobName, environment, gpus
-                )
-                logger.debug("Running %r", subLine)
+                newJob = self.waitingJobs.pop(0)
+                subLine = self.prepareJobSubmission(newJob)
                 batchJobID = self.boss.with_retries(self.submitJob, subLine)
-                if self.boss._outbox is not None:
-                    # JobID corresponds to the toil version of the jobID, dif from jobstore idea of the id, batchjobid is what we get from slurm
-                    self.boss._outbox.publish(
-                        ExternalBatchIdMessage(
-                            jobID, batchJobID, self.boss.__class__.__name__
-                        )
-                    )
+                self.addSubmittedJob(newJob[0], batchJobID)
 
-                logger.debug("Submitted job %s", str(batchJobID))
+            return activity
 
-                # Store dict for mapping Toil job ID to batch job ID
-                # TODO: Note that this currently stores a tuple of (batch system
-                # ID, Task), but the second value is None by default and doesn't
-                # seem to be used
-                self.batchJobIDs[jobID] = (batchJobID, None)
+        def prepareJobSubmission(self, job: JobTuple) -> list[str]:
+            """
+            Get the command line to submit the given job with.
 
-                # Add to queue of running jobs
-                with self.runningJobsLock:
-                    self.runningJobs.add(jobID)
+            Called by GridEngineThread.createJobs()
+            """
+            jobID, cpu, memory, command, jobName, environment, gpus = job
+            if self.boss.config.memory_is_product and cpu > 1:
+                memory = memory // cpu
+            # prepare job submission command
+            subLine = self.prepareSubmission(
+                cpu, memory, jobID, command, jobName, environment, gpus
+            )
+            logger.debug("Running %r", subLine)
+            return subLine
 
-            return activity
+        def addSubmittedJob(self, jobID: int, batchJobID: str) -> None:
+            """
+            Start tracking a job that has been submitted to the batch system.
+
+            Called by GridEngineThread.createJobs()
+
+            :param jobID: Toil job ID
+            :param batchJobID: batch system job ID, as returned by submitJob()
+            """
+            if self.boss._outbox is not None:
+                # JobID corresponds to the toil version of the jobID, dif from jobstore idea of the id, batchjobid is what we get from slurm
+                self.boss._outbox.publish(
+                    ExternalBatchIdMessage(
+                        jobID, batchJobID, self.boss.__class__.__name__
+                    )
+                )
+
+            logger.debug("Submitted job %s", str(batchJobID))
+
+            # Store dict for mapping Toil job ID to batch job ID
+            # TODO: Note that this currently stores a tuple of (batch system
+            # ID, Task), but the second value is None by default and doesn't
+            # seem to be used
+            self.batchJobIDs[jobID] = (batchJobID, None)
+
+            # Add to queue of running jobs
+            with self.runningJobsLock:
+                self.runningJobs.add(jobID)
 
         def killJobs(self):
             """
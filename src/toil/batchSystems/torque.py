@@ -14,24 +14,123 @@
 import logging
 import math
 import os
+import re
 import shlex
 import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
 from queue import Empty
 from shlex import quote
-from typing import Optional
+from threading import Lock
+from typing import Optional, Union
 
+from toil.batchSystems.abstractBatchSystem import BatchJobExitReason
 from toil.batchSystems.abstractGridEngineBatchSystem import (
     AbstractGridEngineBatchSystem,
+    JobTuple,
     UpdatedBatchJobInfo,
 )
 from toil.lib.conversions import hms_duration_to_seconds
-from toil.lib.misc import CalledProcessErrorStderr, call_command
+from toil.lib.misc import (
+    CalledProcessErrorStderr,
+    call_command,
+    iter_command_lines,
+)
 
 logger = logging.getLogger(__name__)
 
+# Job states in qstat output that mean a job is no longer running (Completed,
+# Exiting, and PBS Pro's Finished).
+_FINISHED_STATES = ("C", "E", "F")
+
+# A job line of tabular qstat output, capturing the bare job ID, the time used,
+# and the state. Header and separator lines do not match.
+_QSTAT_LINE = re.compile(r"^\s*(\d+)\S*\s+\S+\s+\S+\s+(\S+)\s+([A-Z])\s")
+
+# How many job IDs to put on one qstat command line, to stay well clear of the
+# kernel's argument length limit when we have a lot of jobs.
+_QSTAT_MAX_JOB_IDS = 500
+
+
+# Resource requests that Toil makes itself, and which users may not pass to qsub
+_FORBIDDEN_QSUB_TOKENS = ("mem=", "nodes=", "ppn=")
+
+
+def _check_forbidden(value: str, source: str) -> None:
+    """
+    Make sure user-supplied qsub options don't set resources Toil sets itself.
+
+    :param value: The options to check.
+    :param source: Where the options came from, for the error message.
+    :raises ValueError: if any of the forbidden resource requests are present.
+    """
+    if any(token in value for token in _FORBIDDEN_QSUB_TOKENS):
+        raise ValueError(
+            f"Incompatible resource arguments ('mem=', 'nodes=', 'ppn=') in {source}: {value}"
+        )
+
+
+@lru_cache(maxsize=1)
+def _qsub_options_from_environment() -> tuple[Optional[str], Optional[list[str]]]:
+    """
+    Get the extra qsub options the user set in the environment.
+
+    The environment is read, checked and parsed once, the first time a job is
+    submitted, rather than for every job.
+
+    :return: The TOIL_TORQUE_REQS resource requirements string, and the
+             TOIL_TORQUE_ARGS options split into arguments, each None if unset.
+    :raises ValueError: if either sets resources Toil sets itself.
+    """
+    reqs = os.getenv("TOIL_TORQUE_REQS")
+    if reqs is not None:
+        logger.debug(
+            "Additional Torque resource requirements appended to qsub from "
+            "TOIL_TORQUE_REQS env. variable: %s",
+            reqs,
+        )
+        _check_forbidden(reqs, "TOIL_TORQUE_REQS")
+
+    args = os.getenv("TOIL_TORQUE_ARGS")
+    if args is not None:
+        logger.debug(
+            "Native Torque options appended to qsub from TOIL_TORQUE_ARGS env. variable: %s",
+            args,
+        )
+        _check_forbidden(args, "TOIL_TORQUE_ARGS")
+
+    return reqs, shlex.split(args) if args is not None else None
+
+
+def _chunks(items: list[str], size: int) -> list[list[str]]:
+    """Split a list into consecutive pieces of at most the given size."""
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
 
 class TorqueBatchSystem(AbstractGridEngineBatchSystem):
 
+    @classmethod
+    @lru_cache(maxsize=1)
+    def _detect_version(cls) -> str:
+        """
+        Determines PBS/Torque version via pbsnodes.
+
+        This only ever runs pbsnodes once; the result is shared by all threads.
+
+        :return: "pro" for PBS Pro, or "oss" for open source Torque.
+        """
+        try:
+            out = call_command(["pbsnodes", "--version"])
+        except CalledProcessErrorStderr:
+            logger.error("Could not determine PBS/Torque version")
+            raise
+        if "PBSPro" in out:
+            logger.debug("PBS Pro proprietary Torque version detected")
+            return "pro"
+        logger.debug("Torque OSS version detected")
+        return "oss"
+
     # class-specific Worker
     class GridEngineThread(AbstractGridEngineBatchSystem.GridEngineThread):
         def __init__(
@@ -40,28 +139,109 @@ class TorqueBatchSystem(AbstractGridEngineBatchSystem):
             super().__init__(
                 newJobsQueue, updatedJobsQueue, killQueue, killedJobsQueue, boss
             )
-            self._version = self._pbsVersion()
+            self._version = TorqueBatchSystem._detect_version()
+            # How long a qstat snapshot can be reused before we ask pbs_server
+            # again. checkOnJobs() already only polls every statePollingWait
+            # seconds, so by default don't hold snapshots for longer than that.
+            self._qstat_cache_ttl = float(
+                os.getenv(
+                    "TOIL_TORQUE_POLL_INTERVAL", self.boss.config.statePollingWait
+                )
+            )
+            # Time the snapshot was taken, and the snapshot itself, mapping
+            # bare Torque job ID to (state, walltime) as reported by qstat
+            self._qstat_cache: tuple[float, dict[str, tuple[str, str]]] = (
+                -math.inf,
+                {},
+            )
+            self._qstat_cache_lock = Lock()
+            # The snapshot to use for the coalesce_job_exit_codes() pass in
+            # progress, if any, so that a failing qstat is only run once per
+            # pass
+            self._pass_snapshot: Optional[dict[str, tuple[str, str]]] = None
+            # Bare Torque job IDs we have qdel-ed and are waiting to see the
+            # end of. A snapshot from before the qdel would still show them
+            # running, so their exit codes are always asked for directly.
+            self._killed_jobids: set[str] = set()
+            # Exit statuses fetched in bulk, waiting to be collected by
+            # getJobExitCode(), keyed by bare Torque job ID
+            self._exit_status_cache: dict[str, Optional[int]] = {}
+            # Threads to run qsub in, so that submissions overlap. This also
+            # caps how many submissions we make to pbs_server at once.
+            self._submit_pool = ThreadPoolExecutor(
+                max_workers=int(os.getenv("TOIL_TORQUE_SUBMIT_THREADS", "4")),
+                thread_name_prefix="torque-qsub",
+            )
 
-        def _pbsVersion(self):
-            """Determines PBS/Torque version via pbsnodes"""
+        def run(self):
             try:
-                out = call_command(["pbsnodes", "--version"])
-                if "PBSPro" in out:
-                    logger.debug("PBS Pro proprietary Torque version detected")
-                    self._version = "pro"
-                else:
-                    logger.debug("Torque OSS version detected")
-                    self._version = "oss"
-            except CalledProcessErrorStderr as e:
-                if e.returncode != 0:
-                    logger.error("Could not determine PBS/Torque version")
-
-            return self._version
+                super().run()
+            finally:
+                self._submit_pool.shutdown(wait=False)
 
         """
         Torque-specific AbstractGridEngineWorker methods
         """
 
+        def _get_qstat_snapshot(self) -> dict[str, tuple[str, str]]:
+            """
+            Get the qstat state and walltime of all our running jobs.
+
+            The same qstat output is shared between getRunningJobIDs() and
+            getJobExitCode() for TOIL_TORQUE_POLL_INTERVAL seconds (by default,
+            statePollingWait), so that polling does not cost a qstat call per
+            job.
+
+            :return: dict from bare Torque job ID to (state, walltime) strings.
+            """
+            with self._qstat_cache_lock:
+                timestamp, snapshot = self._qstat_cache
+                if time.monotonic() - timestamp < self._qstat_cache_ttl:
+                    return snapshot
+
+                with self.runningJobsLock:
+                    currentjobs = {
+                        str(self.batchJobIDs[x][0].strip()).split(".")[0]
+                        for x in self.runningJobs
+                    }
+                # qstat doesn't care about the order of the job IDs
+                jobids = list(currentjobs)
+                snapshot = {}
+                for chunk in _chunks(jobids, _QSTAT_MAX_JOB_IDS):
+                    # Only query for job IDs to avoid clogging the batch system on heavily loaded clusters
+                    # PBS plain qstat will return every running job on the system.
+                    if self._version == "pro":
+                        args = ["qstat", "-x"] + chunk
+                    elif self._version == "oss":
+                        args = ["qstat"] + chunk
+
+                    # qstat supports XML output which is more comprehensive, but PBSPro does not support it
+                    # so instead we stick with plain commandline qstat tabular outputs
+                    for currline in iter_command_lines(args):
+                        m = _QSTAT_LINE.match(currline)
+                        if m is None:
+                            continue
+                        jobid, walltime, state = m.groups()
+                        if jobid in currentjobs:
+                            snapshot[jobid] = (state, walltime)
+                self._qstat_cache = (time.monotonic(), snapshot)
+                return snapshot
+
+        def _try_qstat_snapshot(self) -> dict[str, tuple[str, str]]:
+            """
+            Get the qstat snapshot, or an empty one if qstat fails.
+
+            Within a coalesce_job_exit_codes() pass, the snapshot taken at the
+            start of the pass is used.
+            """
+            if self._pass_snapshot is not None:
+                return self._pass_snapshot
+            try:
+                return self._get_qstat_snapshot()
+            except CalledProcessErrorStderr:
+                # Callers fall back on asking about jobs one at a time
+                return {}
+
         def getRunningJobIDs(self):
             times = {}
             with self.runningJobsLock:
@@ -73,42 +253,30 @@ class TorqueBatchSystem(AbstractGridEngineBatchSystem):
             # Skip running qstat if we don't have any current jobs
             if not currentjobs:
                 return times
-            # Only query for job IDs to avoid clogging the batch system on heavily loaded clusters
-            # PBS plain qstat will return every running job on the system.
-            jobids = sorted(list(currentjobs.keys()))
-            if self._version == "pro":
-                stdout = call_command(["qstat", "-x"] + jobids)
-            elif self._version == "oss":
-                stdout = call_command(["qstat"] + jobids)
-
-            # qstat supports XML output which is more comprehensive, but PBSPro does not support it
-            # so instead we stick with plain commandline qstat tabular outputs
-            for currline in stdout.split("\n"):
-                items = currline.strip().split()
-                if items:
-                    jobid = items[0].strip().split(".")[0]
-                    if jobid in currentjobs:
-                        logger.debug("getRunningJobIDs job status for is: %s", items[4])
-                    if jobid in currentjobs and items[4] == "R":
-                        walltime = items[3].strip()
-                        logger.debug(
-                            "getRunningJobIDs qstat reported walltime is: %s", walltime
+
+            for jobid, (state, walltime) in self._get_qstat_snapshot().items():
+                if jobid not in currentjobs:
+                    continue
+                logger.debug("getRunningJobIDs job status for is: %s", state)
+                if state == "R":
+                    logger.debug(
+                        "getRunningJobIDs qstat reported walltime is: %s", walltime
+                    )
+                    # normal qstat has a quirk with job time where it reports '0'
+                    # when initially running; this catches this case
+                    if walltime == "0":
+                        walltime = 0.0
+                    elif not walltime:
+                        # Sometimes we don't get any data here.
+                        # See https://github.com/DataBiosphere/toil/issues/3715
+                        logger.warning(
+                            "Assuming 0 walltime due to missing field in qstat line for job %s",
+                            jobid,
                         )
-                        # normal qstat has a quirk with job time where it reports '0'
-                        # when initially running; this catches this case
-                        if walltime == "0":
-                            walltime = 0.0
-                        elif not walltime:
-                            # Sometimes we don't get any data here.
-                            # See https://github.com/DataBiosphere/toil/issues/3715
-                            logger.warning(
-                                "Assuming 0 walltime due to missing field in qstat line: %s",
-                                currline,
-                            )
-                            walltime = 0.0
-                        else:
-                            walltime = hms_duration_to_seconds(walltime)
-                        times[currentjobs[jobid]] = walltime
+                        walltime = 0.0
+                    else:
+                        walltime = hms_duration_to_seconds(walltime)
+                    times[currentjobs[jobid]] = walltime
 
             logger.debug("Job times from qstat are: %s", times)
             return times
@@ -118,8 +286,9 @@ class TorqueBatchSystem(AbstractGridEngineBatchSystem):
                 logger.debug("getUpdatedBatchJob: Job updates")
                 item = self.updatedJobsQueue.get(timeout=maxWait)
                 self.updatedJobsQueue.task_done()
-                jobID, retcode = (self.jobIDs[item.jobID], item.exitStatus)
-                self.currentjobs -= {self.jobIDs[item.jobID]}
+                jobID = self.jobIDs[item.jobID]
+                retcode = item.exitStatus
+                self.currentjobs.discard(jobID)
             except Empty:
                 logger.debug("getUpdatedBatchJob: Job queue is empty")
             else:
@@ -128,7 +297,11 @@ class TorqueBatchSystem(AbstractGridEngineBatchSystem):
                 )
 
         def killJob(self, jobID):
-            call_command(["qdel", self.getBatchSystemID(jobID)])
+            batch_id = self.getBatchSystemID(jobID)
+            call_command(["qdel", batch_id])
+            # Don't trust cached qstat states for this job when confirming the
+            # kill.
+            self._killed_jobids.add(str(batch_id).split(".")[0])
 
         def prepareSubmission(
             self,
@@ -147,26 +320,111 @@ class TorqueBatchSystem(AbstractGridEngineBatchSystem):
         def submitJob(self, subLine):
             return call_command(subLine)
 
+        def createJobs(self, newJob: JobTuple) -> bool:
+            """
+            Submit as many waiting jobs as we have room for, running the qsub
+            calls in parallel instead of one after the other.
+            """
+            if newJob is not None:
+                self.waitingJobs.append(newJob)
+            max_jobs = int(self.boss.config.max_jobs)
+            to_submit: list[JobTuple] = []
+            while (
+                self.waitingJobs and len(self.runningJobs) + len(to_submit) < max_jobs
+            ):
+                to_submit.append(self.waitingJobs.pop(0))
+            if not to_submit:
+                return False
+
+            submissions: list[tuple[int, Future[str]]] = []
+            for job in to_submit:
+                subLine = self.prepareJobSubmission(job)
+                submissions.append(
+                    (
+                        job[0],
+                        self._submit_pool.submit(
+                            self.boss.with_retries, self.submitJob, subLine
+                        ),
+                    )
+                )
+
+            # Keep track of every job that did get submitted before reporting
+            # any failure, so that none of them are lost.
+            error: Optional[BaseException] = None
+            for jobID, future in submissions:
+                try:
+                    self.addSubmittedJob(jobID, future.result())
+                except Exception as e:
+                    if error is None:
+                        error = e
+            if error is not None:
+                raise error
+            return True
+
+        def coalesce_job_exit_codes(
+            self, batch_job_id_list: list
+        ) -> list[Union[int, tuple[int, Optional[BatchJobExitReason]], None]]:
+            """
+            Collect the exit codes of all the given jobs.
+
+            The full status of all the jobs that have finished is fetched with
+            a single qstat call, and then handed out by getJobExitCode().
+
+            :param batch_job_id_list: list of Torque job ID strings
+            """
+            snapshot = self._try_qstat_snapshot()
+            finished = []
+            for batch_job_id in batch_job_id_list:
+                state = snapshot.get(str(batch_job_id).split(".")[0], (None, None))[0]
+                if state is None or state in _FINISHED_STATES:
+                    finished.append(batch_job_id)
+            if len(finished) > 1:
+                self._refresh_exit_statuses(finished)
+            # Don't take another snapshot for each job, even if this one failed
+            self._pass_snapshot = snapshot
+            try:
+                return super().coalesce_job_exit_codes(batch_job_id_list)
+            finally:
+                self._pass_snapshot = None
+
         def getJobExitCode(self, torqueJobID):
+            jobid = str(torqueJobID).split(".")[0]
+            if jobid in self._killed_jobids:
+                # We are waiting to see this job die, so ask about it directly.
+                status = self._getJobExitCodeDirectly(torqueJobID)
+                if status is not None:
+                    self._killed_jobids.discard(jobid)
+                return status
+
+            if jobid in self._exit_status_cache:
+                # We already asked about this job along with some others
+                return self._exit_status_cache.pop(jobid)
+
+            state = self._try_qstat_snapshot().get(jobid, (None, None))[0]
+            if state is not None and state not in _FINISHED_STATES:
+                # Job is still queued or running as of the last qstat, so
+                # don't bother asking for its full status.
+                return None
+            return self._getJobExitCodeDirectly(torqueJobID)
+
+        def _getJobExitCodeDirectly(self, torqueJobID):
+            """
+            Ask qstat for the exit status of just the given job.
+
+            :return: the exit status, or None if the job has not finished.
+            """
+            jobid = str(torqueJobID).split(".")[0]
+
             if self._version == "pro":
-                args = ["qstat", "-x", "-f", str(torqueJobID).split(".")[0]]
+                args = ["qstat", "-x", "-f", jobid]
             elif self._version == "oss":
-                args = ["qstat", "-f", str(torqueJobID).split(".")[0]]
+                args = ["qstat", "-f", jobid]
 
-            stdout = call_command(args)
-            for line in stdout.split("\n"):
+            for line in iter_command_lines(args):
                 line = line.strip()
-                # Case differences due to PBSPro vs OSS Torque qstat outputs
-                if (
-                    line.startswith("failed")
-                    or line.startswith("FAILED")
-                    and int(line.split()[1]) == 1
-                ):
-                    return 1
-                if line.startswith("exit_status") or line.startswith("Exit_status"):
-                    status = line.split(" = ")[1]
-                    logger.debug("Exit Status: %s", status)
-                    return int(status)
+                status = self._parseExitStatusLine(line)
+                if status is not None:
+                    return status
                 if "unknown job id" in line.lower():
                     # some clusters configure Torque to forget everything about just
                     # finished jobs instantly, apparently for performance reasons
@@ -181,6 +439,58 @@ class TorqueBatchSystem(AbstractGridEngineBatchSystem):
         Implementation-specific helper methods
         """
 
+        def _refresh_exit_statuses(self, jobids: list[str]) -> None:
+            """
+            Fetch the exit statuses of the given jobs with as few qstat calls as we can.
+
+            Results are stored in self._exit_status_cache, keyed by bare job
+            ID, with None for jobs that have no exit status yet. Jobs qstat
+            doesn't report on are left out, as is every job in a qstat call
+            that fails (for example because it has forgotten some of the
+            jobs), and getJobExitCode() asks about each of them alone.
+            """
+            jobids = [str(jobid).split(".")[0] for jobid in jobids]
+            for chunk in _chunks(jobids, _QSTAT_MAX_JOB_IDS):
+                if self._version == "pro":
+                    args = ["qstat", "-x", "-f"] + chunk
+                elif self._version == "oss":
+                    args = ["qstat", "-f"] + chunk
+
+                wanted = set(chunk)
+                # Only jobs that have their own block in the output go in here
+                statuses: dict[str, Optional[int]] = {}
+                current = None
+                try:
+                    for line in iter_command_lines(args):
+                        line = line.strip()
+                        if line.startswith("Job Id:"):
+                            current = line.split(":", 1)[1].strip().split(".")[0]
+                            if current in wanted:
+                                statuses.setdefault(current, None)
+                        elif current in statuses and statuses[current] is None:
+                            statuses[current] = self._parseExitStatusLine(line)
+                except CalledProcessErrorStderr as e:
+                    logger.debug("Could not get exit statuses in bulk: %s", e)
+                    continue
+                self._exit_status_cache.update(statuses)
+
+        def _parseExitStatusLine(self, line: str) -> Optional[int]:
+            """
+            Get the exit status reported by a stripped line of qstat -f output, if any.
+            """
+            # Case differences due to PBSPro vs OSS Torque qstat outputs
+            if (
+                line.startswith("failed")
+                or line.startswith("FAILED")
+                and int(line.split()[1]) == 1
+            ):
+                return 1
+            if line.startswith("exit_status") or line.startswith("Exit_status"):
+                status = line.split(" = ")[1]
+                logger.debug("Exit Status: %s", status)
+                return int(status)
+            return None
+
         def prepareQsub(
             self,
             cpu: int,
@@ -194,16 +504,19 @@ class TorqueBatchSystem(AbstractGridEngineBatchSystem):
 
             qsubline = ["qsub", "-S", "/bin/sh", "-V", "-N", f"toil_job_{jobID}"]
 
-            environment = self.boss.environment.copy()
             if job_environment:
+                environment = self.boss.environment.copy()
                 environment.update(job_environment)
+            else:
+                # Nothing to add, so we can use the shared environment as-is
+                environment = self.boss.environment
 
             if environment:
                 qsubline.append("-v")
                 qsubline.append(
                     ",".join(
                         k + "=" + quote(os.environ[k] if v is None else v)
-                        for k, v in self.boss.environment.items()
+                        for k, v in environment.items()
                     )
                 )
 
@@ -222,22 +535,8 @@ class TorqueBatchSystem(AbstractGridEngineBatchSystem):
                     reqline.append("nodes=1:ppn=" + str(int(math.ceil(cpu))))
 
             # Other resource requirements can be passed through the environment (see man qsub)
-            reqlineEnv = os.getenv("TOIL_TORQUE_REQS")
+            reqlineEnv, argsEnv = _qsub_options_from_environment()
             if reqlineEnv is not None:
-                logger.debug(
-                    "Additional Torque resource requirements appended to qsub from "
-                    "TOIL_TORQUE_REQS env. variable: %s",
-                    reqlineEnv,
-                )
-                if (
-                    ("mem=" in reqlineEnv)
-                    or ("nodes=" in reqlineEnv)
-                    or ("ppn=" in reqlineEnv)
-                ):
-                    raise ValueError(
-                        f"Incompatible resource arguments ('mem=', 'nodes=', 'ppn='): {reqlineEnv}"
-                    )
-
                 reqline.append(reqlineEnv)
 
             if reqline:
@@ -246,21 +545,8 @@ class TorqueBatchSystem(AbstractGridEngineBatchSystem):
             # All other qsub parameters can be passed through the environment (see man qsub).
             # No attempt is made to parse them out here and check that they do not conflict
             # with those that we already constructed above
-            arglineEnv = os.getenv("TOIL_TORQUE_ARGS")
-            if arglineEnv is not None:
-                logger.debug(
-                    "Native Torque options appended to qsub from TOIL_TORQUE_ARGS env. variable: %s",
-                    arglineEnv,
-                )
-                if (
-                    ("mem=" in arglineEnv)
-                    or ("nodes=" in arglineEnv)
-                    or ("ppn=" in arglineEnv)
-                ):
-                    raise ValueError(
-                        f"Incompatible resource arguments ('mem=', 'nodes=', 'ppn='): {arglineEnv}"
-                    )
-                qsubline += shlex.split(arglineEnv)
+            if argsEnv is not None:
+                qsubline += argsEnv
 
             return qsubline
 
@@ -276,12 +562,17 @@ class TorqueBatchSystem(AbstractGridEngineBatchSystem):
                 jobID, r"${PBS_JOBID}", "err"
             )
 
+            script = (
+                "#!/bin/sh\n"
+                f"#PBS -o {stdoutfile}\n"
+                f"#PBS -e {stderrfile}\n"
+                "cd $PBS_O_WORKDIR\n\n"
+                f"{command}\n"
+            )
             fd, tmp_file = tempfile.mkstemp(suffix=".sh", prefix="torque_wrapper")
-            with open(tmp_file, "w") as f:
-                f.write("#!/bin/sh\n")
-                f.write(f"#PBS -o {stdoutfile}\n")
-                f.write(f"#PBS -e {stderrfile}\n")
-                f.write("cd $PBS_O_WORKDIR\n\n")
-                f.write(command + "\n")
-            os.close(fd)
+            try:
+                # Write the whole script at once through the descriptor we already have
+                os.write(fd, script.encode("utf-8"))
+            finally:
+                os.close(fd)
             return tmp_file
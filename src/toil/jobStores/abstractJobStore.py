@@ -17,7 +17,7 @@ import pickle
 import re
 import shutil
 from abc import ABC, ABCMeta, abstractmethod
-from collections.abc import Iterator, ValuesView
+from collections.abc import Iterable, Iterator, ValuesView
 from contextlib import closing, contextmanager
 from datetime import timedelta
 from http.client import BadStatusLine
@@ -1553,6 +1553,19 @@ class AbstractJobStore(ABC):
         """
         raise NotImplementedError()
 
+    def files_exist(self, file_ids: Iterable[str]) -> set[str]:
+        """
+        Determine which of the given files exist in this job store.
+
+        Job stores that can check on several files at once should override
+        this; by default each file is checked in turn.
+
+        :param file_ids: IDs referencing the files to be checked
+
+        :return: the IDs of the given files that exist
+        """
+        return {file_id for file_id in file_ids if self.file_exists(file_id)}
+
     @deprecated(new_function_name="get_file_size")
     def getFileSize(self, jobStoreFileID: str) -> int:
         """Get the size of the given file in bytes."""
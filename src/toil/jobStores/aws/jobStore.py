@@ -788,6 +788,35 @@ class AWSJobStore(AbstractJobStore):
     def file_exists(self, file_id):
         return self.FileInfo.exists(file_id)
 
+    itemsPerExistenceSelect = 20
+
+    def files_exist(self, file_ids):
+        # Ask SimpleDB about several files per request rather than one at a
+        # time.
+        file_ids = [str(file_id) for file_id in file_ids]
+        indicator = self.FileInfo.presenceIndicator()
+        present = set()
+        n = self.itemsPerExistenceSelect
+        for i in range(0, len(file_ids), n):
+            names = ", ".join(
+                "'%s'" % file_id.replace("'", "''") for file_id in file_ids[i : i + n]
+            )
+            items: Optional[list["ItemTypeDef"]] = None
+            for attempt in retry_sdb():
+                with attempt:
+                    items = list(
+                        boto3_pager(
+                            self.db.select,
+                            "Items",
+                            ConsistentRead=True,
+                            SelectExpression=f"select {indicator} from `{self.files_domain_name}` "
+                            f"where itemName() in ({names}) and {indicator} is not null",
+                        )
+                    )
+            assert items is not None
+            present.update(item["Name"] for item in items)
+        return present
+
     def get_file_size(self, file_id):
         if not self.file_exists(file_id):
             return 0
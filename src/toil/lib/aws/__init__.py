@@ -17,6 +17,7 @@ import os
 import re
 import socket
 from collections.abc import MutableMapping
+from functools import lru_cache
 from http.client import HTTPException
 from typing import TYPE_CHECKING, Literal, Optional, Union
 from urllib.error import URLError
@@ -39,6 +40,9 @@ AWSServerErrors = toil.lib.retry.ErrorCondition(
 
 logger = logging.getLogger(__name__)
 
+# Matches an availability zone (e.g. us-west-1c), capturing its region
+AWS_ZONE_REGEX = re.compile(r"^([a-z]{2}-[a-z]+-[1-9][0-9]*)([a-z])$")
+
 # This file isn't allowed to import anything that depends on Boto or Boto3,
 # which may not be installed, because it has to be importable everywhere.
 
@@ -60,10 +64,14 @@ def get_aws_zone_from_environment() -> Optional[str]:
     return os.environ.get("TOIL_AWS_ZONE", None)
 
 
+@lru_cache(maxsize=1)
 def get_aws_zone_from_metadata() -> Optional[str]:
     """
     Get the AWS zone from instance metadata, if on EC2 and the boto module is
     available. Otherwise, gets the AWS zone from ECS task metadata, if on ECS.
+
+    The metadata services are only consulted once per process, since we can't
+    move between zones and probing can take a second when we aren't on AWS.
     """
 
     # When running on ECS, we also appear to be running on EC2, but the EC2
@@ -162,9 +170,7 @@ def get_current_aws_zone() -> Optional[str]:
 
 def zone_to_region(zone: str) -> AWSRegionName:
     """Get a region (e.g. us-west-2) from a zone (e.g. us-west-1c)."""
-    # re.compile() caches the regex internally so we don't have to
-    availability_zone = re.compile(r"^([a-z]{2}-[a-z]+-[1-9][0-9]*)([a-z])$")
-    m = availability_zone.match(zone)
+    m = AWS_ZONE_REGEX.match(zone)
     if not m:
         raise ValueError(f"Can't extract region from availability zone '{zone}'")
     return m.group(1)
@@ -1,11 +1,14 @@
 import fnmatch
 import json
 import logging
+import re
 from collections import defaultdict
+from collections.abc import Collection, Mapping
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
-from typing import TYPE_CHECKING, Any, Optional, Union
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Callable, Optional, TypeVar, Union
 
-import boto3
 from botocore.exceptions import ClientError
 
 from toil.lib.aws import AWSServerErrors, session
@@ -24,42 +27,52 @@ if TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 # TODO Make this comprehensive
-CLUSTER_LAUNCHING_PERMISSIONS = [
-    "iam:CreateRole",
-    "iam:CreateInstanceProfile",
-    "iam:TagInstanceProfile",
-    "iam:DeleteRole",
-    "iam:DeleteRoleProfile",
-    "iam:ListAttatchedRolePolicies",
-    "iam:ListPolicies",
-    "iam:ListRoleTags",
-    "iam:PassRole",
-    "iam:PutRolePolicy",
-    "iam:RemoveRoleFromInstanceProfile",
-    "iam:TagRole",
-    "ec2:AuthorizeSecurityGroupIngress",
-    "ec2:CancelSpotInstanceRequests",
-    "ec2:CreateSecurityGroup",
-    "ec2:CreateTags",
-    "ec2:DeleteSecurityGroup",
-    "ec2:DescribeAvailabilityZones",
-    "ec2:DescribeImages",
-    "ec2:DescribeInstances",
-    "ec2:DescribeInstanceStatus",
-    "ec2:DescribeKeyPairs",
-    "ec2:DescribeSecurityGroups",
-    "ec2:DescribeSpotInstanceRequests",
-    "ec2:DescribeSpotPriceHistory",
-    "ec2:DescribeVolumes",
-    "ec2:ModifyInstanceAttribute",
-    "ec2:RequestSpotInstances",
-    "ec2:RunInstances",
-    "ec2:StartInstances",
-    "ec2:StopInstances",
-    "ec2:TerminateInstances",
-]
-
-AllowedActionCollection = dict[str, dict[str, list[str]]]
+CLUSTER_LAUNCHING_PERMISSIONS: frozenset[str] = frozenset(
+    {
+        "iam:CreateRole",
+        "iam:CreateInstanceProfile",
+        "iam:TagInstanceProfile",
+        "iam:DeleteRole",
+        "iam:DeleteInstanceProfile",
+        "iam:ListAttachedRolePolicies",
+        "iam:ListPolicies",
+        "iam:ListRoleTags",
+        "iam:PassRole",
+        "iam:PutRolePolicy",
+        "iam:RemoveRoleFromInstanceProfile",
+        "iam:TagRole",
+        "ec2:AuthorizeSecurityGroupIngress",
+        "ec2:CancelSpotInstanceRequests",
+        "ec2:CreateSecurityGroup",
+        "ec2:CreateTags",
+        "ec2:DeleteSecurityGroup",
+        "ec2:DescribeAvailabilityZones",
+        "ec2:DescribeImages",
+        "ec2:DescribeInstances",
+        "ec2:DescribeInstanceStatus",
+        "ec2:DescribeKeyPairs",
+        "ec2:DescribeSecurityGroups",
+        "ec2:DescribeSpotInstanceRequests",
+        "ec2:DescribeSpotPriceHistory",
+        "ec2:DescribeVolumes",
+        "ec2:ModifyInstanceAttribute",
+        "ec2:RequestSpotInstances",
+        "ec2:RunInstances",
+        "ec2:StartInstances",
+        "ec2:StopInstances",
+        "ec2:TerminateInstances",
+    }
+)
+
+AllowedActionCollection = dict[str, dict[str, set[str]]]
+# A read-only AllowedActionCollection, safe to share between callers
+FrozenActionCollection = Mapping[str, Mapping[str, frozenset[str]]]
+
+# How many IAM API requests to have in flight at once when fetching policies
+MAX_CONCURRENT_IAM_REQUESTS = 10
+
+T = TypeVar("T")
+R = TypeVar("R")
 
 
 @retry(errors=[AWSServerErrors])
@@ -91,8 +104,9 @@ def delete_iam_role(
     :param quiet: Whether or not to print/log information about the deletion to stdout.
     """
     # TODO: This function could benefit from less complex Boto3 type hints
-    iam_client = session.client("iam", region_name=region)
     iam_resource = session.resource("iam", region_name=region)
+    # Use the resource's own client, so all the deletions share one connection
+    iam_client = iam_resource.meta.client
     role = iam_resource.Role(role_name)
     # normal policies
     for attached_policy in role.attached_policies.all():
@@ -177,7 +191,7 @@ def init_action_collection() -> AllowedActionCollection:
     A NotAction will explicitly allow all actions that don't match a specific pattern
     eg iam:* allows all non iam actions
     """
-    return defaultdict(lambda: {"Action": [], "NotAction": []})
+    return defaultdict(lambda: {"Action": set(), "NotAction": set()})
 
 
 def add_to_action_collection(
@@ -188,18 +202,35 @@ def add_to_action_collection(
     """
     to_return = init_action_collection()
     for key in a.keys():
-        to_return[key]["Action"] += a[key]["Action"]
-        to_return[key]["NotAction"] += a[key]["NotAction"]
+        to_return[key]["Action"] |= a[key]["Action"]
+        to_return[key]["NotAction"] |= a[key]["NotAction"]
 
     for key in b.keys():
-        to_return[key]["Action"] += b[key]["Action"]
-        to_return[key]["NotAction"] += b[key]["NotAction"]
+        to_return[key]["Action"] |= b[key]["Action"]
+        to_return[key]["NotAction"] |= b[key]["NotAction"]
 
     return to_return
 
 
+def freeze_action_collection(
+    actions: AllowedActionCollection,
+) -> FrozenActionCollection:
+    """
+    Make a read-only copy of an action collection
+    """
+    return MappingProxyType(
+        {
+            resource: MappingProxyType(
+                {kind: frozenset(patterns) for kind, patterns in by_kind.items()}
+            )
+            for resource, by_kind in actions.items()
+        }
+    )
+
+
 def policy_permissions_allow(
-    given_permissions: AllowedActionCollection, required_permissions: list[str] = []
+    given_permissions: Mapping[str, Mapping[str, Collection[str]]],
+    required_permissions: Collection[str] = frozenset(),
 ) -> bool:
     """
     Check whether given set of actions are a subset of another given set of actions, returns true if they are
@@ -215,26 +246,28 @@ def policy_permissions_allow(
 
     missing_perms = []
 
+    # Compile each set of patterns once, rather than globbing for every permission
+    # Look the resource up without adding it, since the collection may be shared
+    by_kind = given_permissions.get(resource, {})
+    allowed = _compile_permission_patterns(by_kind.get("Action", ()))
+    not_allowed = _compile_permission_patterns(by_kind.get("NotAction", ()))
+
     for permission in required_permissions:
-        if not permission_matches_any(
-            permission, given_permissions[resource]["Action"]
-        ):
-            if given_permissions[resource]["NotAction"] == [] or permission_matches_any(
-                permission, given_permissions[resource]["NotAction"]
-            ):
+        if allowed is None or not allowed.match(permission):
+            if not_allowed is None or not_allowed.match(permission):
                 missing_perms.append(permission)
 
     if missing_perms:
         logger.warning(
             "You appear to lack the folowing AWS permissions: %s",
-            ", ".join(missing_perms),
+            ", ".join(sorted(missing_perms)),
         )
         return False
 
     return True
 
 
-def permission_matches_any(perm: str, list_perms: list[str]) -> bool:
+def permission_matches_any(perm: str, list_perms: Collection[str]) -> bool:
     """
     Takes a permission and checks whether it's contained within a list of given permissions
     Returns True if it is otherwise False
@@ -243,10 +276,24 @@ def permission_matches_any(perm: str, list_perms: list[str]) -> bool:
     :param list_perms: Permission list to check against
     """
 
-    for allowed in list_perms:
-        if fnmatch.fnmatch(perm, allowed):
-            return True
-    return False
+    pattern = _compile_permission_patterns(list_perms)
+    return pattern is not None and pattern.match(perm) is not None
+
+
+def _compile_permission_patterns(
+    list_perms: Collection[str],
+) -> Optional[re.Pattern[str]]:
+    """
+    Compile a list of permission patterns with wildcards into a single regex
+    that matches any permission matched by any of them.
+
+    Returns None if there are no patterns, since then nothing can match.
+
+    :param list_perms: Permission patterns, using fnmatch-style wildcards
+    """
+    if not list_perms:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in list_perms))
 
 
 def get_actions_from_policy_document(
@@ -265,7 +312,11 @@ def get_actions_from_policy_document(
 
         if statement["Effect"] == "Allow":
 
-            for resource in statement["Resource"]:
+            resources = statement["Resource"]
+            if isinstance(resources, str):
+                # A single resource, which we must not iterate over by character
+                resources = [resources]
+            for resource in resources:
                 for key in ["Action", "NotAction"]:
                     if key in statement.keys():
                         # mypy_boto3_iam declares policy document as a TypedDict
@@ -274,14 +325,33 @@ def get_actions_from_policy_document(
                         # https://docs.aws.amazon.com/IAM/latest/UserGuide/reference_policies_elements_notaction.html
                         # so type: ignore for now
                         if isinstance(statement[key], list):  # type: ignore[literal-required]
-                            allowed_actions[resource][key] += statement[key]  # type: ignore[literal-required]
+                            allowed_actions[resource][key].update(statement[key])  # type: ignore[literal-required]
                         else:
                             # Assumes that if it isn't a list it's probably a string
-                            allowed_actions[resource][key].append(statement[key])  # type: ignore[literal-required]
+                            allowed_actions[resource][key].add(statement[key])  # type: ignore[literal-required]
 
     return allowed_actions
 
 
+def _fetch_concurrently(fetch: Callable[[T], R], items: list[T]) -> list[R]:
+    """
+    Call fetch on each item, in parallel threads, and return the results in order.
+
+    Meant for independent, read-only AWS API calls, where the time is
+    dominated by the round trip. Boto3 clients are safe to share between
+    threads.
+
+    :param fetch: Function making the API call for one item
+    :param items: Items to call it on
+    """
+    if len(items) <= 1:
+        return [fetch(item) for item in items]
+    with ThreadPoolExecutor(
+        max_workers=min(MAX_CONCURRENT_IAM_REQUESTS, len(items))
+    ) as pool:
+        return list(pool.map(fetch, items))
+
+
 def allowed_actions_attached(
     iam: "IAMClient", attached_policies: list["AttachedPolicyTypeDef"]
 ) -> AllowedActionCollection:
@@ -292,14 +362,18 @@ def allowed_actions_attached(
     :param attached_policies: Attached policies
     """
 
-    allowed_actions: AllowedActionCollection = init_action_collection()
-    for policy in attached_policies:
+    def get_policy_document(
+        policy: "AttachedPolicyTypeDef",
+    ) -> "PolicyDocumentDictTypeDef":
         policy_desc = iam.get_policy(PolicyArn=policy["PolicyArn"])
         policy_ver = iam.get_policy_version(
             PolicyArn=policy_desc["Policy"]["Arn"],
             VersionId=policy_desc["Policy"]["DefaultVersionId"],
         )
-        policy_document = policy_ver["PolicyVersion"]["Document"]
+        return policy_ver["PolicyVersion"]["Document"]
+
+    allowed_actions: AllowedActionCollection = init_action_collection()
+    for policy_document in _fetch_concurrently(get_policy_document, attached_policies):
         # TODO whenever boto fixes the typing, stop ignoring this line in typecheck
         allowed_actions = add_to_action_collection(allowed_actions, get_actions_from_policy_document(policy_document))  # type: ignore
 
@@ -319,8 +393,13 @@ def allowed_actions_roles(
     """
     allowed_actions: AllowedActionCollection = init_action_collection()
 
-    for policy_name in policy_names:
-        role_policy = iam.get_role_policy(RoleName=role_name, PolicyName=policy_name)
+    role_policies = _fetch_concurrently(
+        lambda policy_name: iam.get_role_policy(
+            RoleName=role_name, PolicyName=policy_name
+        ),
+        policy_names,
+    )
+    for role_policy in role_policies:
         logger.debug("Checking role policy")
         # PolicyDocument is now a TypedDict, but an instance of TypedDict is not an instance of dict?
         if isinstance(role_policy["PolicyDocument"], str):
@@ -365,12 +444,12 @@ def allowed_actions_user(
     :param policy_names: Name of policy document associated with a user
     :param user_name: Name of user to get associated policies
     """
-    user_policies = [
-        iam.get_user_policy(UserName=user_name, PolicyName=policy_name)[
-            "PolicyDocument"
-        ]
-        for policy_name in policy_names
-    ]
+    user_policies = _fetch_concurrently(
+        lambda policy_name: iam.get_user_policy(
+            UserName=user_name, PolicyName=policy_name
+        )["PolicyDocument"],
+        policy_names,
+    )
     return collect_policy_actions(user_policies)
 
 
@@ -385,77 +464,109 @@ def allowed_actions_group(
     :param policy_names: Name of policy document associated with a user
     :param group_name: Name of group to get associated policies
     """
-    group_policies = [
-        iam.get_group_policy(GroupName=group_name, PolicyName=policy_name)[
-            "PolicyDocument"
-        ]
-        for policy_name in policy_names
-    ]
+    group_policies = _fetch_concurrently(
+        lambda policy_name: iam.get_group_policy(
+            GroupName=group_name, PolicyName=policy_name
+        )["PolicyDocument"],
+        policy_names,
+    )
     return collect_policy_actions(group_policies)
 
 
-def get_policy_permissions(region: str) -> AllowedActionCollection:
+class _IncompletePermissionsError(Exception):
+    """
+    Raised when not all of the policies granting permissions could be read.
+
+    Carries what could be read, so that it can be used without being cached.
+    """
+
+    def __init__(self, permissions: FrozenActionCollection) -> None:
+        super().__init__("Could not read all IAM policies")
+        self.permissions = permissions
+
+
+def get_policy_permissions(region: str) -> FrozenActionCollection:
     """
     Returns an action collection containing lists of all permission grant patterns keyed by resource
     that they are allowed upon. Requires AWS credentials to be associated with a user or assumed role.
 
+    Complete results are cached per region for the life of the process, so they are read-only. If
+    some policies could not be read, what could be read is returned, and we try again next time.
+
     :param zone: AWS zone to connect to
     """
+    try:
+        return _get_policy_permissions(region)
+    except _IncompletePermissionsError as e:
+        return e.permissions
+
+
+@lru_cache(maxsize=4)
+def _get_policy_permissions(region: str) -> FrozenActionCollection:
+    """
+    Do the work for get_policy_permissions().
+
+    :raises _IncompletePermissionsError: if an IAM error kept us from reading
+            all the policies, so that the result is not cached.
+    """
 
     iam: "IAMClient" = get_client("iam", region)
     sts: "STSClient" = get_client("sts", region)
     # TODO Condider effect: deny at some point
-    allowed_actions: AllowedActionCollection = defaultdict(
-        lambda: {"Action": [], "NotAction": []}
-    )
-    try:
-        # If successful then we assume we are operating as a user, and grab the associated permissions
-        user = iam.get_user()
-        list_policies = iam.list_user_policies(UserName=user["User"]["UserName"])
-        attached_policies = iam.list_attached_user_policies(
-            UserName=user["User"]["UserName"]
-        )
-        user_attached_policies = allowed_actions_attached(
-            iam, attached_policies["AttachedPolicies"]
-        )
-        allowed_actions = add_to_action_collection(
-            allowed_actions, user_attached_policies
-        )
-        user_inline_policies = allowed_actions_user(
-            iam, list_policies["PolicyNames"], user["User"]["UserName"]
-        )
-        allowed_actions = add_to_action_collection(
-            allowed_actions, user_inline_policies
-        )
+    allowed_actions: AllowedActionCollection = init_action_collection()
+    complete = True
 
-        # grab group policies associated with the user
-        groups = iam.list_groups_for_user(UserName=user["User"]["UserName"])
-        for group in groups["Groups"]:
-            list_policies = iam.list_group_policies(GroupName=group["GroupName"])
-            attached_policies = iam.list_attached_group_policies(
-                GroupName=group["GroupName"]
-            )
-            group_attached_policies = allowed_actions_attached(
+    # Work out whether we are a user or a role from who we are calling as,
+    # rather than by seeing what fails.
+    caller_arn = sts.get_caller_identity()["Arn"]
+    if ":user/" in caller_arn:
+        # We are operating as a user, so grab the associated permissions
+        try:
+            user_name = iam.get_user()["User"]["UserName"]
+            list_policies = iam.list_user_policies(UserName=user_name)
+            attached_policies = iam.list_attached_user_policies(UserName=user_name)
+            user_attached_policies = allowed_actions_attached(
                 iam, attached_policies["AttachedPolicies"]
             )
             allowed_actions = add_to_action_collection(
-                allowed_actions, group_attached_policies
+                allowed_actions, user_attached_policies
             )
-            group_inline_policies = allowed_actions_group(
-                iam, list_policies["PolicyNames"], group["GroupName"]
+            user_inline_policies = allowed_actions_user(
+                iam, list_policies["PolicyNames"], user_name
             )
             allowed_actions = add_to_action_collection(
-                allowed_actions, group_inline_policies
+                allowed_actions, user_inline_policies
             )
 
-    except:
-        # If not successful, we check the role associated with an instance profile
-        # and grab the role's associated permissions
-        role = sts.get_caller_identity()
+            # grab group policies associated with the user
+            groups = iam.list_groups_for_user(UserName=user_name)
+            for group in groups["Groups"]:
+                list_policies = iam.list_group_policies(GroupName=group["GroupName"])
+                attached_policies = iam.list_attached_group_policies(
+                    GroupName=group["GroupName"]
+                )
+                group_attached_policies = allowed_actions_attached(
+                    iam, attached_policies["AttachedPolicies"]
+                )
+                allowed_actions = add_to_action_collection(
+                    allowed_actions, group_attached_policies
+                )
+                group_inline_policies = allowed_actions_group(
+                    iam, list_policies["PolicyNames"], group["GroupName"]
+                )
+                allowed_actions = add_to_action_collection(
+                    allowed_actions, group_inline_policies
+                )
+        except ClientError:
+            logger.exception("Exception when trying to get user policies")
+            complete = False
+    elif ":assumed-role/" in caller_arn:
+        # We are operating as a role, probably through an instance profile,
+        # so grab the role's associated permissions.
         # Splits a role arn of format 'arn:aws:sts::123456789012:assumed-role/my-role-name/my-role-session-name'
         # on "/" and takes the second element to get the role name to list policies
+        role_name = caller_arn.split("/")[1]
         try:
-            role_name = role["Arn"].split("/")[1]
             list_policies = iam.list_role_policies(RoleName=role_name)
             attached_policies = iam.list_attached_role_policies(RoleName=role_name)
             role_attached_policies = allowed_actions_attached(
@@ -470,11 +581,20 @@ def get_policy_permissions(region: str) -> AllowedActionCollection:
             allowed_actions = add_to_action_collection(
                 allowed_actions, role_inline_policies
             )
-
-        except:
+        except ClientError:
+            # The role may well not be allowed to look at its own policies
             logger.exception("Exception when trying to get role policies")
+            complete = False
+    else:
+        logger.warning(
+            "Cannot determine the permissions of %s, which is not a user or role",
+            caller_arn,
+        )
     logger.debug("Allowed actions: %s", allowed_actions)
-    return allowed_actions
+    permissions = freeze_action_collection(allowed_actions)
+    if not complete:
+        raise _IncompletePermissionsError(permissions)
+    return permissions
 
 
 @lru_cache
@@ -482,4 +602,5 @@ def get_aws_account_num() -> Optional[str]:
     """
     Returns AWS account num
     """
-    return boto3.client("sts").get_caller_identity().get("Account")
+    sts: "STSClient" = get_client("sts")
+    return sts.get_caller_identity().get("Account")
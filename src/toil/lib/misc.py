@@ -6,6 +6,7 @@ import random
 import socket
 import subprocess
 import sys
+import tempfile
 import time
 from collections.abc import Iterator
 from contextlib import closing
@@ -214,3 +215,65 @@ def call_command(
         )
     )
     return stdout
+
+
+def iter_command_lines(
+    cmd: list[str],
+    useCLocale: bool = True,
+    env: Optional[dict[str, str]] = None,
+) -> Iterator[str]:
+    """
+    Run an external command and yield its standard output line by line.
+
+    Like call_command(), but the caller can start parsing output while the
+    command is still running, and the whole output is never held in memory.
+
+    If the process fails, CalledProcessErrorStderr is raised once all of its
+    output has been consumed. If the caller stops iterating early, the rest of
+    the output is discarded and the exit status is not checked.
+
+    :param useCLocale: If True, C locale is forced, to prevent failures that
+           can occur in some batch systems when using UTF-8 locale.
+    """
+    if useCLocale:
+        env = dict(os.environ) if env is None else dict(env)  # copy since modifying
+        env["LANGUAGE"] = env["LC_ALL"] = "C"
+
+    logger.debug("run command: {}".format(" ".join(cmd)))
+    start_time = datetime.datetime.now()
+    # Collect stderr in a file so a chatty command can't block on it while we
+    # are still reading stdout.
+    with tempfile.TemporaryFile(
+        mode="w+", encoding="utf-8", errors="replace"
+    ) as stderr_file:
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=stderr_file,
+            encoding="utf-8",
+            errors="replace",
+            env=env,
+        )
+        assert proc.stdout is not None
+        try:
+            # Not "yield from", which would close the pipe if we are closed
+            for line in proc.stdout:
+                yield line
+        finally:
+            # Read anything the caller didn't want so the command can finish
+            for _ in proc.stdout:
+                pass
+            proc.stdout.close()
+            proc.wait()
+        runtime = (datetime.datetime.now() - start_time).total_seconds()
+        stderr_file.seek(0)
+        stderr = stderr_file.read()
+    sys.stderr.write(stderr)
+    if proc.returncode != 0:
+        logger.debug(
+            "command failed in {}s: {}: {}".format(
+                runtime, " ".join(cmd), stderr.rstrip()
+            )
+        )
+        raise CalledProcessErrorStderr(proc.returncode, cmd, stderr=stderr)
+    logger.debug("command succeeded in {}s: {}".format(runtime, " ".join(cmd)))
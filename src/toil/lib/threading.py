@@ -28,9 +28,11 @@ import tempfile
 import threading
 import time
 import traceback
+from collections import deque
 from collections.abc import Iterator
 from contextlib import contextmanager
-from typing import Optional, Union, cast
+from queue import Empty
+from typing import Generic, Optional, TypeVar, Union, cast
 
 import psutil
 
@@ -228,6 +230,75 @@ class ExceptionalThread(threading.Thread):
             raise_(exc_type, exc_value, traceback)
 
 
+T = TypeVar("T")
+
+
+class SPSCQueue(Generic[T]):
+    """
+    An unbounded FIFO queue for exactly one producer thread and exactly one consumer thread.
+
+    Putting an item, and getting one when the queue is not empty, just append
+    to or pop from a deque, which is atomic, so neither side takes a lock
+    unless the consumer actually has to wait. Only the consumer can wait; it
+    tells the producer it is waiting so the producer can wake it up.
+
+    >>> q = SPSCQueue()
+    >>> q.put(1)
+    >>> q.put(2)
+    >>> q.get(), q.get()
+    (1, 2)
+    """
+
+    def __init__(self) -> None:
+        self._items: deque[T] = deque()
+        self._not_empty = threading.Condition(threading.Lock())
+        self._consumer_waiting = False
+
+    def put(self, item: T) -> None:
+        """Add an item to the queue. Only call from the producer thread."""
+        self._items.append(item)
+        # The consumer sets this before it last checks the deque, so if it
+        # missed our item it must be waiting (or about to), and will get woken.
+        if self._consumer_waiting:
+            # Notify while still holding the lock. The consumer can't get
+            # between our check and the notify, and the scheduler doesn't have
+            # to wake it only for it to block on the lock again.
+            with self._not_empty:
+                self._not_empty.notify()
+
+    def get(self, timeout: Optional[float] = None) -> T:
+        """
+        Remove and return the next item. Only call from the consumer thread.
+
+        :param timeout: How long to wait for an item, in seconds. Waits forever
+               if None, and not at all if 0.
+        :raises queue.Empty: if no item arrives in time.
+        """
+        try:
+            return self._items.popleft()
+        except IndexError:
+            if timeout is not None and timeout <= 0:
+                raise Empty()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._not_empty:
+            self._consumer_waiting = True
+            try:
+                while True:
+                    try:
+                        return self._items.popleft()
+                    except IndexError:
+                        pass
+                    if deadline is None:
+                        self._not_empty.wait()
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise Empty()
+                        self._not_empty.wait(remaining)
+            finally:
+                self._consumer_waiting = False
+
+
 def cpu_count() -> int:
     """
     Get the rounded-up integer number of whole CPUs available.
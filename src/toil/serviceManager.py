@@ -16,13 +16,14 @@
 import logging
 import time
 from collections.abc import Iterable
-from queue import Empty, Queue
-from threading import Event, Thread
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, SimpleQueue
+from threading import Event, Lock, Thread
 from typing import Optional
 
 from toil.job import ServiceJobDescription
 from toil.jobStores.abstractJobStore import AbstractJobStore
-from toil.lib.throttle import LocalThrottle, throttle
+from toil.lib.threading import SPSCQueue
 from toil.toilState import ToilState
 
 logger = logging.getLogger(__name__)
@@ -31,6 +32,22 @@ logger = logging.getLogger(__name__)
 class ServiceManager:
     """Manages the scheduling of services."""
 
+    # Bounds, in seconds, on how long to wait between checks on services that
+    # are starting up.
+    MIN_POLL_INTERVAL = 0.01
+    MAX_POLL_INTERVAL = 1.0
+
+    # Minimum time, in seconds, between progress messages about starting
+    # services.
+    LOG_INTERVAL = 60.0
+
+    # Most job store requests to make at once when killing services.
+    MAX_CONCURRENT_DELETES = 32
+
+    # Most job store requests to make at once when checking on services that
+    # are starting up.
+    MAX_CONCURRENT_PROBES = 16
+
     def __init__(self, job_store: AbstractJobStore, toil_state: ToilState) -> None:
         logger.debug("Initializing service manager")
         self.__job_store = job_store
@@ -43,27 +60,43 @@ class ServiceManager:
         # start.
         self.__waiting_clients: set[str] = set()
 
-        # This is used to terminate the thread associated with the service
-        # manager
+        # This is used to stop the thread associated with the service manager
+        # while it is waiting on batches of services. Otherwise it waits on
+        # __clients_in, and is stopped by a None there.
         self.__terminate = Event()
 
-        # This is the input queue of jobs that have services that need to be started
-        self.__clients_in: Queue[str] = Queue()
+        # This is the input queue of jobs that have services that need to be
+        # started. A None on the queue tells the thread to stop.
+        self.__clients_in: SimpleQueue[Optional[str]] = SimpleQueue()
+
+        # The output queues below are only put to by the service-managing
+        # thread and only gotten from by the leader.
 
         # This is the output queue of jobs that have services that
         # are already started
-        self.__clients_out: Queue[str] = Queue()
+        self.__clients_out: SPSCQueue[str] = SPSCQueue()
 
         # This is the output queue of jobs that have services that are unable
         # to start
-        self.__failed_clients_out: Queue[str] = Queue()
+        self.__failed_clients_out: SPSCQueue[str] = SPSCQueue()
 
-        # This is the queue of services for the batch system to start
-        self.__services_out: Queue[str] = Queue()
+        # This is the queue of services for the batch system to start.
+        self.__services_out: SPSCQueue[str] = SPSCQueue()
 
         # The number of jobs the service manager is scheduling
         self.__service_manager_jobs = 0
 
+        # This protects __waiting_clients and __service_manager_jobs, which
+        # can be used from more than one thread.
+        self.__state_lock = Lock()
+
+        # Threads for the service-managing thread to check on starting
+        # services with. These last as long as the service manager does.
+        self.__probe_pool = ThreadPoolExecutor(
+            max_workers=self.MAX_CONCURRENT_PROBES,
+            thread_name_prefix="toil-service-probe",
+        )
+
         # Set up the service-managing thread.
         self.__service_starter = Thread(target=self.__start_services, daemon=True)
 
@@ -73,7 +106,8 @@ class ServiceManager:
 
         :return: True if the services for the given job are currently being started, and False otherwise.
         """
-        return job_id in self.__waiting_clients
+        with self.__state_lock:
+            return job_id in self.__waiting_clients
 
     def get_job_count(self) -> int:
         """
@@ -81,7 +115,8 @@ class ServiceManager:
 
         (services and their parent non-service jobs)
         """
-        return self.__service_manager_jobs
+        with self.__state_lock:
+            return self.__service_manager_jobs
 
     def start(self) -> None:
         """Start the service scheduling thread."""
@@ -101,13 +136,14 @@ class ServiceManager:
 
         logger.debug("Service manager queueing %s as client", client)
 
-        # Add job to set being processed by the service manager
-        self.__waiting_clients.add(client_id)
+        with self.__state_lock:
+            # Add job to set being processed by the service manager
+            self.__waiting_clients.add(client_id)
 
-        # Add number of jobs managed by ServiceManager
-        self.__service_manager_jobs += (
-            len(client.services) + 1
-        )  # The plus one accounts for the root job
+            # Add number of jobs managed by ServiceManager
+            self.__service_manager_jobs += (
+                len(client.services) + 1
+            )  # The plus one accounts for the root job
 
         # Asynchronously schedule the services
         self.__clients_in.put(client_id)
@@ -122,12 +158,9 @@ class ServiceManager:
         """
         try:
             client_id = self.__clients_out.get(timeout=maxWait)
-            self.__waiting_clients.remove(client_id)
-            if self.__service_manager_jobs < 0:
-                raise RuntimeError(
-                    "The number of jobs scheduled by the service manager cannot be negative."
-                )
-            self.__service_manager_jobs -= 1
+            with self.__state_lock:
+                self.__waiting_clients.remove(client_id)
+                self.__service_manager_jobs -= 1
             return client_id
         except Empty:
             return None
@@ -142,12 +175,9 @@ class ServiceManager:
         """
         try:
             client_id = self.__failed_clients_out.get(timeout=maxWait)
-            self.__waiting_clients.remove(client_id)
-            if self.__service_manager_jobs < 0:
-                raise RuntimeError(
-                    "The number of jobs scheduled by the service manager cannot be negative."
-                )
-            self.__service_manager_jobs -= 1
+            with self.__state_lock:
+                self.__waiting_clients.remove(client_id)
+                self.__service_manager_jobs -= 1
             return client_id
         except Empty:
             return None
@@ -161,11 +191,8 @@ class ServiceManager:
         """
         try:
             service_id = self.__services_out.get(timeout=maxWait)
-            if self.__service_manager_jobs < 0:
-                raise RuntimeError(
-                    "The number of jobs scheduled by the service manager cannot be negative."
-                )
-            self.__service_manager_jobs -= 1
+            with self.__state_lock:
+                self.__service_manager_jobs -= 1
             return service_id
         except Empty:
             return None
@@ -185,14 +212,39 @@ class ServiceManager:
         :param services: Service jobStoreIDs to kill
         :param error: Whether to signal that the service failed with an error when stopping it.
         """
+        # Work out the error and terminate flag files to delete for each.
+        flag_ids = []
         for service_id in service_ids:
             # Get the job description, which knows about the flag files.
             service = self._get_service_job(service_id)
             if service.errorJobStoreID is None or service.terminateJobStoreID is None:
                 raise Exception("Must be a registered ServiceJobDescription")
-            if error:
-                self.__job_store.delete_file(service.errorJobStoreID)
-            self.__job_store.delete_file(service.terminateJobStoreID)
+            flag_ids.append((service.errorJobStoreID, service.terminateJobStoreID))
+
+        if len(flag_ids) <= 1:
+            for flags in flag_ids:
+                self._delete_one(flags, error)
+            return
+        # Each delete is a round trip to the job store, so kill the services
+        # together.
+        with ThreadPoolExecutor(
+            max_workers=min(self.MAX_CONCURRENT_DELETES, len(flag_ids))
+        ) as pool:
+            list(pool.map(lambda flags: self._delete_one(flags, error), flag_ids))
+
+    def _delete_one(self, flags: tuple[str, str], error: bool) -> None:
+        """
+        Delete the flag files that stop one service.
+
+        :param flags: The service's error and terminate flag file IDs.
+        :param error: Whether to signal that the service failed with an error.
+        """
+        error_id, terminate_id = flags
+        # The service only checks its error flag once it sees its terminate
+        # flag is gone, so the error flag has to go first.
+        if error:
+            self.__job_store.delete_file(error_id)
+        self.__job_store.delete_file(terminate_id)
 
     def is_active(self, service_id: str) -> bool:
         """
@@ -236,7 +288,10 @@ class ServiceManager:
         logger.debug("Waiting for service manager thread to finish ...")
         start_time = time.time()
         self.__terminate.set()
+        # Wake the thread up if it is waiting for clients
+        self.__clients_in.put(None)
         self.__service_starter.join()
+        self.__probe_pool.shutdown()
         # Kill any services still running to avoid deadlock
         for services in list(self.__toil_state.servicesIssued.values()):
             self.kill_services(services, error=True)
@@ -245,119 +300,197 @@ class ServiceManager:
             time.time() - start_time,
         )
 
+    def __files_exist(self, file_ids: Iterable[str]) -> set[str]:
+        """
+        Find which of the given files exist in the job store.
+
+        If the job store only knows how to check one file at a time, splits
+        the files up among the probe threads, so that checking on many files
+        costs about as long as a few job store round trips. A job store with
+        its own files_exist batches its requests itself, so we leave it to it.
+        """
+        file_ids = list(file_ids)
+        if (
+            len(file_ids) <= 1
+            or type(self.__job_store).files_exist is not AbstractJobStore.files_exist
+        ):
+            return self.__job_store.files_exist(file_ids)
+        n = -(-len(file_ids) // self.MAX_CONCURRENT_PROBES)
+        present: set[str] = set()
+        for found in self.__probe_pool.map(
+            self.__job_store.files_exist,
+            (file_ids[i : i + n] for i in range(0, len(file_ids), n)),
+        ):
+            present |= found
+        return present
+
     def __start_services(self) -> None:
         """Thread used to schedule services."""
         # Keep the user informed, but not too informed, as services start up
-        log_limiter = LocalThrottle(60)
+        last_log = float("-inf")
 
-        # These are all keyed by ID
-        starting_services = set()
+        # These are all keyed by ID. For each service we are waiting on, we
+        # keep its start and error flag file IDs, its description, and the
+        # client that needs it.
+        starting_services: dict[str, tuple[str, str, ServiceJobDescription, str]] = {}
         remaining_services_by_client = {}
-        service_to_client = {}
         clients_with_failed_services = set()
+
+        # When to next check on the starting services, and how long to wait
+        # between checks. We check quickly right after services are issued,
+        # and back off as they take longer to come up.
+        next_poll = time.monotonic()
+        poll_interval = self.MIN_POLL_INTERVAL
         while True:
-            with throttle(1.0):
-                if self.__terminate.is_set():
+            # Every client waiting on us has a service still starting, so if
+            # there are none we have nothing to check on.
+            idle = not starting_services
+            if idle:
+                # Sleep until we get a new client or are told to stop.
+                timeout: Optional[float] = None
+            else:
+                timeout = max(0.0, next_poll - time.monotonic())
+            try:
+                client_id = self.__clients_in.get(timeout=timeout)
+            except Empty:
+                # No new jobs that need services scheduled.
+                pass
+            else:
+                if client_id is None:
                     logger.debug("Received signal to quit starting services.")
                     break
-                try:
-                    client_id = self.__clients_in.get_nowait()
-                    client = self.__toil_state.get_job(client_id)
-                    host_id_batches = list(client.serviceHostIDsInBatches())
+                client = self.__toil_state.get_job(client_id)
+                # Only look as far as the second batch, if any, since we don't
+                # need the rest here.
+                host_id_batches = client.serviceHostIDsInBatches()
+                batch = next(host_id_batches, [])
+                if next(host_id_batches, None) is not None:
                     logger.debug(
-                        "Service manager processing client %s with %d batches of services",
+                        "Service manager processing client %s with multiple batches of services",
                         client,
-                        len(host_id_batches),
                     )
-                    if len(host_id_batches) > 1:
-                        # Have to fall back to the old blocking behavior to
-                        # ensure entire service "groups" are issued as a whole.
-                        self.__start_batches_blocking(client_id)
-                        continue
-                    # Found a new job that needs to schedule its services.
-                    for batch in host_id_batches:
-                        # There should be just one batch so we can do it here.
-                        remaining_services_by_client[client_id] = len(batch)
-                        for service_id in batch:
-                            # Load up the service object.
-                            service_job_desc = self._get_service_job(service_id)
-                            # Remember the parent job
-                            service_to_client[service_id] = client_id
-                            # We should now start to monitor this service to see if
-                            # it has started yet.
-                            starting_services.add(service_id)
-                            # Send the service JobDescription off to be started
-                            logger.debug(
-                                "Service manager is starting service job: %s, start ID: %s",
-                                service_job_desc,
-                                service_job_desc.startJobStoreID,
-                            )
-                            self.__services_out.put(service_id)
-                except Empty:
-                    # No new jobs that need services scheduled.
-                    pass
-
-                pending_service_count = len(starting_services)
-                if pending_service_count > 0 and log_limiter.throttle(False):
-                    logger.debug("%d services are starting...", pending_service_count)
-
-                for service_id in list(starting_services):
+                    # Have to fall back to the old blocking behavior to
+                    # ensure entire service "groups" are issued as a whole.
+                    self.__start_batches_blocking(client_id)
+                    continue
+                logger.debug(
+                    "Service manager processing client %s with one batch of services",
+                    client,
+                )
+                # Found a new job that needs to schedule its services. There
+                # is just one batch so we can do it here.
+                remaining_services_by_client[client_id] = len(batch)
+                for service_id in batch:
+                    # Load up the service object.
                     service_job_desc = self._get_service_job(service_id)
                     if (
                         service_job_desc.startJobStoreID is None
                         or service_job_desc.errorJobStoreID is None
                     ):
                         raise Exception("Must be a registered ServiceJobDescription")
-                    if not self.__job_store.file_exists(
-                        service_job_desc.startJobStoreID
-                    ):
-                        # Service has started (or failed)
-                        logger.debug(
-                            "Service %s has removed %s and is therefore started",
+                    # We should now start to monitor this service to see if
+                    # it has started yet, remembering the parent job.
+                    starting_services[service_id] = (
+                        service_job_desc.startJobStoreID,
+                        service_job_desc.errorJobStoreID,
+                        service_job_desc,
+                        client_id,
+                    )
+                    # Send the service JobDescription off to be started
+                    logger.debug(
+                        "Service manager is starting service job: %s, start ID: %s",
+                        service_job_desc,
+                        service_job_desc.startJobStoreID,
+                    )
+                    self.__services_out.put(service_id)
+                # New services are out, so look for them to come up soon.
+                soon = time.monotonic() + self.MIN_POLL_INTERVAL
+                if idle:
+                    # There's nothing else to check on, so start backing off
+                    # afresh.
+                    poll_interval = self.MIN_POLL_INTERVAL
+                    next_poll = soon
+                else:
+                    # Keep backing off for the services already starting, so
+                    # a steady stream of clients doesn't keep us polling fast.
+                    next_poll = min(next_poll, soon)
+
+            now = time.monotonic()
+            if now < next_poll:
+                # Not time to check on the starting services yet.
+                continue
+
+            pending_service_count = len(starting_services)
+            if pending_service_count > 0 and now - last_log >= self.LOG_INTERVAL:
+                last_log = now
+                logger.debug("%d services are starting...", pending_service_count)
+
+            # Check on all the starting services at once.
+            still_starting = self.__files_exist(
+                start_id for start_id, _, _, _ in starting_services.values()
+            )
+
+            started = []
+            # Clients that have had *all* their services started.
+            ready_clients = []
+            for service_id, (
+                start_id,
+                error_id,
+                service_job_desc,
+                client_id,
+            ) in starting_services.items():
+                if start_id in still_starting:
+                    continue
+                # Service has started (or failed)
+                logger.debug(
+                    "Service %s has removed %s and is therefore started",
+                    service_job_desc,
+                    start_id,
+                )
+                remaining_services_by_client[client_id] -= 1
+                if remaining_services_by_client[client_id] == 0:
+                    ready_clients.append(client_id)
+                started.append((service_id, error_id, service_job_desc, client_id))
+
+            if started:
+                # Check that the started services didn't fail, again all at
+                # once.
+                not_failed = self.__files_exist(
+                    error_id for _, error_id, _, _ in started
+                )
+                for service_id, error_id, service_job_desc, client_id in started:
+                    del starting_services[service_id]
+                    if error_id not in not_failed:
+                        logger.error(
+                            "Service %s has immediately failed before it could be used",
                             service_job_desc,
-                            service_job_desc.startJobStoreID,
                         )
-                        starting_services.remove(service_id)
-                        client_id = service_to_client[service_id]
-                        remaining_services_by_client[client_id] -= 1
-                        if remaining_services_by_client[client_id] < 0:
-                            raise RuntimeError(
-                                "The number of remaining services cannot be negative."
-                            )
-                        del service_to_client[service_id]
-                        if not self.__job_store.file_exists(
-                            service_job_desc.errorJobStoreID
-                        ):
-                            logger.error(
-                                "Service %s has immediately failed before it could be used",
-                                service_job_desc,
-                            )
-                            # It probably hasn't fileld in the promise that the
-                            # job that uses the service needs.
-                            clients_with_failed_services.add(client_id)
-
-                # Find if any clients have had *all* their services started.
-                ready_clients = set()
-                for (
-                    client_id,
-                    remainingServices,
-                ) in remaining_services_by_client.items():
-                    if remainingServices == 0:
-                        if client_id in clients_with_failed_services:
-                            logger.error(
-                                "Job %s has had all its services try to start, but at least one failed",
-                                self.__toil_state.get_job(client_id),
-                            )
-                            self.__failed_clients_out.put(client_id)
-                        else:
-                            logger.debug(
-                                "Job %s has all its services started",
-                                self.__toil_state.get_job(client_id),
-                            )
-                            self.__clients_out.put(client_id)
-                        ready_clients.add(client_id)
-                for client_id in ready_clients:
-                    del remaining_services_by_client[client_id]
+                        # It probably hasn't fileld in the promise that the
+                        # job that uses the service needs.
+                        clients_with_failed_services.add(client_id)
+
+            for client_id in ready_clients:
+                # We know it's there, since its count just reached 0.
+                del remaining_services_by_client[client_id]
+                if client_id in clients_with_failed_services:
+                    # We don't need to remember this failure any more.
+                    clients_with_failed_services.remove(client_id)
+                    logger.error(
+                        "Job %s has had all its services try to start, but at least one failed",
+                        self.__toil_state.get_job(client_id),
+                    )
+                    self.__failed_clients_out.put(client_id)
+                else:
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(
+                            "Job %s has all its services started",
+                            self.__toil_state.get_job(client_id),
+                        )
+                    self.__clients_out.put(client_id)
+
+            # Back off until the next check.
+            poll_interval = min(poll_interval * 2, self.MAX_POLL_INTERVAL)
+            next_poll = now + poll_interval
 
     def __start_batches_blocking(self, client_id: str) -> None:
         """
@@ -366,15 +499,16 @@ class ServiceManager:
         (Starting them in batches that are all issued together)
         """
         # Keep the user informed, but not too informed, as services start up
-        log_limiter = LocalThrottle(60)
+        last_log = float("-inf")
 
         # Start the service jobs in batches, waiting for each batch
         # to become established before starting the next batch
         for service_job_list in self.__toil_state.get_job(
             client_id
         ).serviceHostIDsInBatches():
-            # When we get the job descriptions we store them here to go over them again.
-            wait_on = []
+            # When we get the job descriptions we store them here to go over
+            # them again, by start flag ID.
+            wait_on = {}
             for service_id in service_job_list:
                 # Find the service object.
                 service_job_desc = self._get_service_job(service_id)
@@ -401,30 +535,38 @@ class ServiceManager:
                 # any time! So we can't assert their presence here.
                 self.__services_out.put(service_id)
                 # Save for the waiting loop
-                wait_on.append(service_job_desc)
+                wait_on[service_job_desc.startJobStoreID] = service_job_desc
+
+            # Wait until all the services of the batch are running. Check on
+            # the whole batch at once, quickly at first and backing off as the
+            # services take longer to come up.
+            delay = self.MIN_POLL_INTERVAL
+            while True:
+                still_starting = self.__files_exist(wait_on.keys())
+                wait_on = {
+                    start_id: service_job_desc
+                    for start_id, service_job_desc in wait_on.items()
+                    if start_id in still_starting
+                }
+                if not wait_on:
+                    break
 
-            # Wait until all the services of the batch are running
-            for service_id in service_job_list:
-                # Find the service object.
-                service_job_desc = self._get_service_job(service_id)
-                if service_job_desc.startJobStoreID is None:
-                    raise Exception("Must be a registered ServiceJobDescription")
-                while self.__job_store.file_exists(service_job_desc.startJobStoreID):
-                    # Sleep to avoid thrashing
-                    time.sleep(1.0)
+                # Sleep to avoid thrashing, but stop as soon as the thread
+                # should quit.
+                if self.__terminate.wait(delay):
+                    return
+                delay = min(delay * 2, self.MAX_POLL_INTERVAL)
 
-                    if log_limiter.throttle(False):
+                now = time.monotonic()
+                if now - last_log >= self.LOG_INTERVAL:
+                    last_log = now
+                    for service_job_desc in wait_on.values():
                         logger.info("Service %s is starting...", service_job_desc)
 
-                    # Check if the thread should quit
-                    if self.__terminate.is_set():
-                        return
-
+                for start_id, service_job_desc in wait_on.items():
                     if not self.__toil_state.job_exists(
                         str(service_job_desc.jobStoreID)
-                    ) and self.__job_store.file_exists(
-                        service_job_desc.startJobStoreID
-                    ):
+                    ) and self.__job_store.file_exists(start_id):
                         # The service job has gone away but the service never flipped its start flag.
                         # That's not what the worker is supposed to do when running a service at all.
                         logger.error(
@@ -436,15 +578,15 @@ class ServiceManager:
                             f"Service {service_job_desc} is in an inconsistent state"
                         )
 
-                # We don't bail out early here.
+            # We don't bail out early here.
 
-                # We need to try and fail to start *all* the services, so they
-                # *all* come back to the leader as expected, or the leader will get
-                # stuck waiting to hear about a later dependent service failing. So
-                # we have to *try* to start all the services, even if the services
-                # they depend on failed. They should already have been killed,
-                # though, so they should stop immediately when we run them. TODO:
-                # this is a bad design!
+            # We need to try and fail to start *all* the services, so they
+            # *all* come back to the leader as expected, or the leader will get
+            # stuck waiting to hear about a later dependent service failing. So
+            # we have to *try* to start all the services, even if the services
+            # they depend on failed. They should already have been killed,
+            # though, so they should stop immediately when we run them. TODO:
+            # this is a bad design!
 
         # Add the JobDescription to the output queue of jobs whose services have been started
         self.__clients_out.put(client_id)
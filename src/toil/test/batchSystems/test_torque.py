@@ -0,0 +1,264 @@
+import os
+import textwrap
+from queue import Queue
+
+import pytest
+
+import toil.batchSystems.torque
+from toil.lib.misc import CalledProcessErrorStderr
+from toil.test import ToilTest
+from toil.test.batchSystems.test_gridengine import FakeBatchSystem
+
+# Example outputs based on https://docs.adaptivecomputing.com/torque/4-1-3/Content/topics/commands/qstat.htm
+QSTAT_OUTPUT = textwrap.dedent(
+    """\
+    Job ID                    Name             User            Time Use S Queue
+    ------------------------- ---------------- --------------- -------- - -----
+    1.server                  toil_job_1       jondoe          00:01:30 R batch
+    2.server                  toil_job_2       jondoe                 0 R batch
+    3.server                  toil_job_3       jondoe                 0 Q batch
+    4.server                  toil_job_4       jondoe          00:10:00 C batch
+    """
+)
+
+
+def qstat_f_output(job_id, exit_status):
+    return textwrap.dedent(
+        f"""\
+        Job Id: {job_id}.server
+            Job_Name = toil_job_{job_id}
+            job_state = C
+            exit_status = {exit_status}
+        """
+    )
+
+
+class FakeCommands:
+    """
+    Stand-in for call_command that answers pbsnodes and qstat and remembers what was called.
+    """
+
+    def __init__(self):
+        self.calls = []
+        # Jobs that qstat has purged. Asking about several jobs including one
+        # of these fails, and asking about one alone reports it as unknown.
+        self.forgotten = set()
+        # Jobs that qstat -f quietly leaves out when asked about several jobs
+        self.unlisted = set()
+
+    def __call__(self, args, **_):
+        self.calls.append(args)
+        if args[0] == "pbsnodes":
+            return "pbs_version = 6.1.2"
+        if args[0] == "qdel":
+            return ""
+        if args[0] == "qsub":
+            return f"{args[args.index('-N') + 1].split('_')[-1]}.server\n"
+        if args[0] == "qstat":
+            job_ids = [arg for arg in args[1:] if not arg.startswith("-")]
+            if len(job_ids) == 1 and job_ids[0] in self.forgotten:
+                return f"qstat: Unknown Job Id {job_ids[0]}.server"
+            if self.forgotten.intersection(job_ids):
+                raise CalledProcessErrorStderr(
+                    153, args, stderr="qstat: Unknown Job Id Error"
+                )
+            if "-f" in args:
+                if len(job_ids) > 1:
+                    job_ids = [
+                        job_id for job_id in job_ids if job_id not in self.unlisted
+                    ]
+                return "\n".join(
+                    qstat_f_output(job_id, int(job_id) + 2) for job_id in job_ids
+                )
+            return QSTAT_OUTPUT
+        raise RuntimeError(f"Unexpected command: {args}")
+
+    def iter_lines(self, args, **kwargs):
+        return iter(self(args, **kwargs).splitlines(keepends=True))
+
+    def count(self, *prefix):
+        return sum(1 for call in self.calls if tuple(call[: len(prefix)]) == prefix)
+
+
+class TorqueTest(ToilTest):
+    """
+    Class for unit-testing TorqueBatchSystem
+    """
+
+    def setUp(self):
+        self.monkeypatch = pytest.MonkeyPatch()
+        self.commands = FakeCommands()
+        self.monkeypatch.setattr(
+            toil.batchSystems.torque, "call_command", self.commands
+        )
+        self.monkeypatch.setattr(
+            toil.batchSystems.torque, "iter_command_lines", self.commands.iter_lines
+        )
+        toil.batchSystems.torque.TorqueBatchSystem._detect_version.cache_clear()
+        toil.batchSystems.torque._qsub_options_from_environment.cache_clear()
+        self.worker = self.make_worker()
+        for job_id in range(1, 5):
+            self.worker.batchJobIDs[job_id] = (f"{job_id}.server", None)
+            self.worker.runningJobs.add(job_id)
+
+    def make_worker(self):
+        return toil.batchSystems.torque.TorqueBatchSystem.GridEngineThread(
+            newJobsQueue=Queue(),
+            updatedJobsQueue=Queue(),
+            killQueue=Queue(),
+            killedJobsQueue=Queue(),
+            boss=FakeBatchSystem(),
+        )
+
+    def tearDown(self):
+        self.monkeypatch.undo()
+
+    def test_version_detected_once(self):
+        other_worker = self.make_worker()
+        assert self.worker._version == other_worker._version == "oss"
+        assert self.commands.count("pbsnodes") == 1
+
+    def test_get_running_job_ids(self):
+        result = self.worker.getRunningJobIDs()
+        assert result == {1: 90.0, 2: 0.0}, f"{result} != {{1: 90.0, 2: 0.0}}"
+
+    def test_qstat_shared_between_calls(self):
+        self.worker.getRunningJobIDs()
+        # Running and queued jobs are answered from the cached qstat output
+        assert self.worker.getJobExitCode("1.server") is None
+        assert self.worker.getJobExitCode("3.server") is None
+        # Finished jobs still need their full status
+        assert self.worker.getJobExitCode("4.server") == 6
+        self.worker.getRunningJobIDs()
+        assert self.commands.count("qstat") == 2
+        assert self.commands.count("qstat", "-f") == 1
+
+    def test_qstat_cache_follows_state_polling_wait(self):
+        assert self.worker._qstat_cache_ttl == self.worker.boss.config.statePollingWait
+
+    def test_killed_job_not_answered_from_cache(self):
+        self.worker.getRunningJobIDs()
+        # Job 1 shows as running in the snapshot we have
+        assert self.worker.getJobExitCode("1.server") is None
+        self.worker.killJob(1)
+        # Confirming the kill has to look past that snapshot
+        assert self.worker.getJobExitCode("1.server") == 3
+        assert self.commands.count("qdel") == 1
+        assert self.commands.count("qstat", "-f", "1") == 1
+        assert self.worker._killed_jobids == set()
+
+    def test_coalesce_job_exit_codes(self):
+        # Pretend qstat has forgotten about jobs 2 and 3 already
+        self.worker._qstat_cache = (float("inf"), {"1": ("R", "00:01:30")})
+        job_ids = ["1.server", "2.server", "3.server"]
+        expected_result = [None, 4, 5]
+        result = self.worker.coalesce_job_exit_codes(job_ids)
+        assert result == expected_result, f"{result} != {expected_result}"
+        # Both finished jobs were asked about in one call
+        assert self.commands.calls == [
+            ["pbsnodes", "--version"],
+            ["qstat", "-f", "2", "3"],
+        ]
+
+    def test_failing_qstat_run_once_per_pass(self):
+        for job_id in range(5, 11):
+            self.worker.batchJobIDs[job_id] = (f"{job_id}.server", None)
+            self.worker.runningJobs.add(job_id)
+        self.commands.forgotten.add("4")
+        job_ids = [f"{job_id}.server" for job_id in range(1, 11)]
+        result = self.worker.coalesce_job_exit_codes(job_ids)
+        # Forgotten jobs are assumed to have succeeded
+        assert result == [3, 4, 5, 0, 7, 8, 9, 10, 11, 12]
+        # One failed snapshot and one failed bulk lookup, then one lookup per job
+        assert self.commands.count("qstat") == 12
+        assert self.commands.count("qstat", "-f") == 11
+
+    def test_unlisted_job_asked_about_alone(self):
+        self.worker._qstat_cache = (float("inf"), {})
+        self.commands.unlisted.add("3")
+        result = self.worker.coalesce_job_exit_codes(["2.server", "3.server"])
+        assert result == [4, 5]
+        assert self.commands.count("qstat", "-f", "3") == 1
+
+    def test_qstat_job_ids_chunked(self):
+        self.monkeypatch.setattr(toil.batchSystems.torque, "_QSTAT_MAX_JOB_IDS", 3)
+        for job_id in range(5, 11):
+            self.worker.batchJobIDs[job_id] = (f"{job_id}.server", None)
+            self.worker.runningJobs.add(job_id)
+        self.worker.getRunningJobIDs()
+        qstat_calls = [call for call in self.commands.calls if call[0] == "qstat"]
+        assert len(qstat_calls) == 4
+        asked_about = sorted(int(job_id) for call in qstat_calls for job_id in call[1:])
+        assert asked_about == list(range(1, 11))
+
+    def use_fake_log_paths(self):
+        self.worker.boss.format_std_out_err_path = (
+            lambda job_id, batch_id, kind: f"/logs/{job_id}.{kind}"
+        )
+
+    def test_generate_torque_wrapper(self):
+        self.use_fake_log_paths()
+        wrapper = self.worker.generateTorqueWrapper("echo hello", 7)
+        try:
+            with open(wrapper) as f:
+                contents = f.read()
+        finally:
+            os.unlink(wrapper)
+        assert contents == (
+            "#!/bin/sh\n"
+            "#PBS -o /logs/7.out\n"
+            "#PBS -e /logs/7.err\n"
+            "cd $PBS_O_WORKDIR\n\n"
+            "echo hello\n"
+        )
+
+    def test_create_jobs(self):
+        self.use_fake_log_paths()
+        self.worker.boss.environment = {}
+        self.worker.boss._outbox = None
+        self.worker.boss.config.max_jobs = 6
+        self.worker.waitingJobs = [
+            (job_id, 1, 1024 * 1024, "echo hello", "job", None, 0)
+            for job_id in range(11, 14)
+        ]
+        try:
+            assert self.worker.createJobs(None)
+        finally:
+            self.worker._submit_pool.shutdown()
+            for call in self.commands.calls:
+                if call[0] == "qsub":
+                    os.unlink(call[-1])
+        # Only two more jobs fit alongside the four already running
+        assert self.worker.waitingJobs == [
+            (13, 1, 1024 * 1024, "echo hello", "job", None, 0)
+        ]
+        assert self.worker.batchJobIDs[11] == ("11.server\n", None)
+        assert self.worker.batchJobIDs[12] == ("12.server\n", None)
+        assert self.worker.runningJobs == {1, 2, 3, 4, 11, 12}
+
+    def test_forbidden_qsub_args(self):
+        self.worker.boss.environment = {}
+        self.monkeypatch.setenv("TOIL_TORQUE_ARGS", "-l nodes=2")
+        self.monkeypatch.delenv("TOIL_TORQUE_REQS", raising=False)
+        with pytest.raises(ValueError):
+            self.worker.prepareQsub(1, 1024 * 1024, 1, None)
+
+    def test_prepare_qsub_environment(self):
+        self.worker.boss.environment = {"SHARED": "1"}
+        qsubline = self.worker.prepareQsub(1, 1024 * 1024, 1, {"JOB": "a b"})
+        assert qsubline[qsubline.index("-v") + 1] == "SHARED=1,JOB='a b'"
+        # The shared environment must not pick up the job's variables
+        assert self.worker.boss.environment == {"SHARED": "1"}
+
+    def test_qsub_options_from_environment(self):
+        self.worker.boss.environment = {}
+        self.monkeypatch.setenv("TOIL_TORQUE_REQS", "walltime=1:00:00")
+        self.monkeypatch.setenv("TOIL_TORQUE_ARGS", "-q 'fat q'")
+        qsubline = self.worker.prepareQsub(1, 1024 * 1024, 1, None)
+        assert qsubline[-4:] == ["-l", "mem=1024K,walltime=1:00:00", "-q", "fat q"]
+        # Changes after the first submission are not noticed
+        self.monkeypatch.setenv("TOIL_TORQUE_ARGS", "-q other")
+        assert self.worker.prepareQsub(1, 1024 * 1024, 2, None)[-2:] == [
+            "-q",
+            "fat q",
+        ]
@@ -514,6 +514,10 @@ class AbstractJobStoreTest:
             #
             for store in jobstore2, jobstore1:
                 self.assertFalse(store.file_exists(fileOne))
+                self.assertEqual(
+                    store.files_exist([fileOne, fileTwo, fileThree]),
+                    {fileTwo, fileThree},
+                )
                 self.assertRaises(NoSuchFileException, store.read_file, fileOne, "")
                 try:
                     with store.read_file_stream(fileOne) as _:
@@ -13,9 +13,11 @@
 # limitations under the License.
 import json
 import logging
+from unittest.mock import MagicMock, patch
 from uuid import uuid4
 
 import boto3
+from botocore.exceptions import ClientError
 from moto import mock_aws
 
 from toil.lib.aws import iam
@@ -28,6 +30,11 @@ logging.basicConfig(level=logging.DEBUG)
 class IAMTest(ToilTest):
     """Check that given permissions and associated functions perform correctly"""
 
+    def setUp(self):
+        super().setUp()
+        # Don't see permissions cached by another test
+        iam._get_policy_permissions.cache_clear()
+
     def test_permissions_iam(self):
         granted_perms = {
             "*": {"Action": ["ec2:*", "iam:*", "s3:*", "sdb:*"], "NotAction": []}
@@ -69,6 +76,29 @@ class IAMTest(ToilTest):
         assert iam.permission_matches_any("iam:*", ["*"]) is True
         assert iam.permission_matches_any("ec2:*", ["iam:*"]) is False
 
+    def test_actions_from_policy_document(self):
+        policy_doc = {
+            "Version": "2012-10-17",
+            "Statement": [
+                {
+                    "Effect": "Allow",
+                    "Action": ["s3:GetObject", "s3:PutObject"],
+                    "Resource": "arn:aws:s3:::bucket/*",
+                },
+                {
+                    "Effect": "Allow",
+                    "Action": "s3:GetObject",
+                    "Resource": ["arn:aws:s3:::bucket/*"],
+                },
+            ],
+        }
+        actions = iam.get_actions_from_policy_document(policy_doc)
+        assert list(actions.keys()) == ["arn:aws:s3:::bucket/*"]
+        assert actions["arn:aws:s3:::bucket/*"]["Action"] == {
+            "s3:GetObject",
+            "s3:PutObject",
+        }
+
     @mock_aws
     def test_get_policy_permissions(self):
         mock_iam = boto3.client("iam")
@@ -165,6 +195,27 @@ class IAMTest(ToilTest):
         assert actions_set == expected_actions
         assert notactions_set == set()
 
+    def test_incomplete_policy_permissions_not_cached(self):
+        sts = MagicMock()
+        sts.get_caller_identity.return_value = {
+            "Arn": "arn:aws:sts::123456789012:assumed-role/my-role/my-session"
+        }
+        iam_client = MagicMock()
+        iam_client.list_role_policies.side_effect = [
+            ClientError(
+                {"Error": {"Code": "Throttling", "Message": "Rate exceeded"}},
+                "ListRolePolicies",
+            ),
+            {"PolicyNames": []},
+        ]
+        iam_client.list_attached_role_policies.return_value = {"AttachedPolicies": []}
+        clients = {"iam": iam_client, "sts": sts}
+        with patch.object(iam, "get_client", lambda name, region: clients[name]):
+            for _ in range(3):
+                iam.get_policy_permissions("us-west-2")
+        # The throttled lookup is tried again, and then the complete one is kept
+        assert iam_client.list_role_policies.call_count == 2
+
     def test_create_delete_iam_role(self):
         region = "us-west-2"
         role_name = f'test{str(uuid4()).replace("-", "")}'
@@ -14,7 +14,11 @@
 import getpass
 import logging
 
-from toil.lib.misc import get_user_name
+from toil.lib.misc import (
+    CalledProcessErrorStderr,
+    get_user_name,
+    iter_command_lines,
+)
 from toil.test import ToilTest
 
 logger = logging.getLogger(__name__)
@@ -87,3 +91,29 @@ class UserNameVeryBrokenTest(ToilTest):
         # Make sure we got something
         self.assertTrue(isinstance(apparent_user_name, str))
         self.assertNotEqual(apparent_user_name, "")
+
+
+class IterCommandLinesTest(ToilTest):
+    """
+    Make sure we can stream the output of external commands.
+    """
+
+    def test_iter_command_lines(self):
+        lines = list(iter_command_lines(["sh", "-c", "echo one; echo two"]))
+        self.assertEqual(lines, ["one\n", "two\n"])
+
+    def test_iter_command_lines_failure(self):
+        lines = []
+        with self.assertRaises(CalledProcessErrorStderr) as context:
+            for line in iter_command_lines(
+                ["sh", "-c", "echo one; echo oops >&2; exit 3"]
+            ):
+                lines.append(line)
+        self.assertEqual(lines, ["one\n"])
+        self.assertEqual(context.exception.returncode, 3)
+        self.assertEqual(context.exception.stderr, "oops\n")
+
+    def test_iter_command_lines_stop_early(self):
+        for line in iter_command_lines(["sh", "-c", "seq 100000; exit 3"]):
+            self.assertEqual(line, "1\n")
+            break
@@ -0,0 +1,188 @@
+# Copyright (C) 2015-2021 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import threading
+import time
+
+from toil.job import JobDescription, ServiceJobDescription
+from toil.serviceManager import ServiceManager
+from toil.test import ToilTest
+from toil.toilState import ToilState
+
+logger = logging.getLogger(__name__)
+
+
+class FakeJobStore:
+    """
+    Just enough of a job store for a ServiceManager and its ToilState.
+
+    Keeps jobs and empty flag files in memory, and records deletions in order.
+    """
+
+    def __init__(self) -> None:
+        self.jobs: dict[str, JobDescription] = {}
+        self.files: set[str] = set()
+        self.deleted: list[str] = []
+        self.lock = threading.Lock()
+        # Deleting files with this suffix takes a while, to shake out races.
+        self.slow_suffix: str = ""
+
+    def job_exists(self, job_id: str) -> bool:
+        return job_id in self.jobs
+
+    def load_job(self, job_id: str) -> JobDescription:
+        return self.jobs[job_id]
+
+    def file_exists(self, file_id: str) -> bool:
+        with self.lock:
+            return file_id in self.files
+
+    def files_exist(self, file_ids):
+        with self.lock:
+            return {file_id for file_id in file_ids if file_id in self.files}
+
+    def delete_file(self, file_id: str) -> None:
+        if self.slow_suffix and file_id.endswith(self.slow_suffix):
+            time.sleep(0.1)
+        with self.lock:
+            self.files.discard(file_id)
+            self.deleted.append(file_id)
+
+
+class ServiceManagerTest(ToilTest):
+    """Test the ServiceManager against an in-memory job store."""
+
+    def setUp(self):
+        super().setUp()
+        self.job_store = FakeJobStore()
+        self.toil_state = ToilState(self.job_store)
+        self.service_manager = ServiceManager(self.job_store, self.toil_state)
+
+    def _add_service(self, service_id: str) -> ServiceJobDescription:
+        """Make a service job with all its flag files present."""
+        service = ServiceJobDescription(requirements={}, jobName="service")
+        service.jobStoreID = service_id
+        service.startJobStoreID = service_id + "-start"
+        service.terminateJobStoreID = service_id + "-terminate"
+        service.errorJobStoreID = service_id + "-error"
+        self.job_store.jobs[service_id] = service
+        self.job_store.files |= {
+            service.startJobStoreID,
+            service.terminateJobStoreID,
+            service.errorJobStoreID,
+        }
+        return service
+
+    def _add_client(
+        self, client_id: str, service_tree: dict[str, list[str]]
+    ) -> JobDescription:
+        """Make a client job that needs the given tree of services."""
+        client = JobDescription(requirements={}, jobName="client")
+        client.jobStoreID = client_id
+        client.serviceTree = service_tree
+        self.job_store.jobs[client_id] = client
+        return client
+
+    def _remove_file(self, file_id: str) -> None:
+        """Remove a flag file, as a service would."""
+        with self.job_store.lock:
+            self.job_store.files.discard(file_id)
+
+    def _start_manager(self) -> None:
+        self.service_manager.start()
+        self.addCleanup(self.service_manager.shutdown)
+
+    def testSingleBatchReady(self):
+        """A client comes back once all its services have started."""
+        services = [self._add_service(f"service{i}") for i in range(3)]
+        self._add_client("client", {service.jobStoreID: [] for service in services})
+        self._start_manager()
+        self.service_manager.put_client("client")
+
+        issued = {self.service_manager.get_startable_service(5) for _ in services}
+        self.assertEqual(issued, {service.jobStoreID for service in services})
+
+        for service in services[:-1]:
+            self._remove_file(service.startJobStoreID)
+        self.assertIsNone(self.service_manager.get_ready_client(0.5))
+
+        self._remove_file(services[-1].startJobStoreID)
+        self.assertEqual(self.service_manager.get_ready_client(5), "client")
+        self.assertIsNone(self.service_manager.get_unservable_client(0))
+        self.assertFalse(self.service_manager.services_are_starting("client"))
+
+    def testFailedServiceIsUnservable(self):
+        """A client whose service removed its error flag can't be served."""
+        services = [self._add_service(f"service{i}") for i in range(2)]
+        self._add_client("client", {service.jobStoreID: [] for service in services})
+        self._start_manager()
+        self.service_manager.put_client("client")
+        for _ in services:
+            self.assertIsNotNone(self.service_manager.get_startable_service(5))
+
+        self._remove_file(services[0].errorJobStoreID)
+        for service in services:
+            self._remove_file(service.startJobStoreID)
+        self.assertEqual(self.service_manager.get_unservable_client(5), "client")
+        self.assertIsNone(self.service_manager.get_ready_client(0))
+
+    def testBatchesStartInOrder(self):
+        """A service isn't issued until the service it depends on has started."""
+        first = self._add_service("first")
+        second = self._add_service("second")
+        self._add_client("client", {"first": ["second"], "second": []})
+        self._start_manager()
+        self.service_manager.put_client("client")
+
+        self.assertEqual(self.service_manager.get_startable_service(5), "first")
+        self.assertIsNone(self.service_manager.get_startable_service(0.5))
+
+        self._remove_file(first.startJobStoreID)
+        self.assertEqual(self.service_manager.get_startable_service(5), "second")
+        self.assertIsNone(self.service_manager.get_ready_client(0.5))
+
+        self._remove_file(second.startJobStoreID)
+        self.assertEqual(self.service_manager.get_ready_client(5), "client")
+
+    def testShutdownWakesIdleThread(self):
+        """Shutting down doesn't wait on a thread with nothing to do."""
+        self.service_manager.start()
+        # Let the thread go to sleep waiting for clients.
+        time.sleep(0.5)
+        start = time.monotonic()
+        self.service_manager.shutdown()
+        self.assertLess(time.monotonic() - start, 0.5)
+        with self.assertRaises(RuntimeError):
+            self.service_manager.check()
+
+    def testKillServicesFlagOrder(self):
+        """When killing with an error, each error flag must go before its terminate flag."""
+        services = [self._add_service(f"service{i}") for i in range(10)]
+        # If deletes for different flags raced, the terminate flags would win.
+        self.job_store.slow_suffix = "-error"
+        self.service_manager.kill_services(
+            [service.jobStoreID for service in services], error=True
+        )
+        deleted = self.job_store.deleted
+        self.assertEqual(len(deleted), 2 * len(services))
+        for service in services:
+            self.assertLess(
+                deleted.index(service.errorJobStoreID),
+                deleted.index(service.terminateJobStoreID),
+            )
+
+        # Without an error, only the terminate flags go.
+        self.job_store.deleted.clear()
+        self.service_manager.kill_services([services[0].jobStoreID])
+        self.assertEqual(self.job_store.deleted, [services[0].terminateJobStoreID])
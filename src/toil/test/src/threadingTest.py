@@ -2,11 +2,18 @@ import logging
 import multiprocessing
 import os
 import random
+import threading
 import time
 import traceback
 from functools import partial
-
-from toil.lib.threading import LastProcessStandingArena, cpu_count, global_mutex
+from queue import Empty
+
+from toil.lib.threading import (
+    LastProcessStandingArena,
+    SPSCQueue,
+    cpu_count,
+    global_mutex,
+)
 from toil.test import ToilTest
 
 log = logging.getLogger(__name__)
@@ -67,6 +74,38 @@ class ThreadingTest(ToilTest):
                     "precious"
                 ), f"File {filename} still exists"
 
+    def testSPSCQueue(self):
+        queue = SPSCQueue()
+        numItems = 10000
+
+        def produce():
+            for item in range(numItems):
+                queue.put(item)
+                if item % 1000 == 0:
+                    # Make the consumer wait sometimes
+                    time.sleep(0.01)
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        try:
+            # Items should all arrive, in order
+            received = [queue.get(timeout=10) for _ in range(numItems)]
+        finally:
+            producer.join()
+        self.assertEqual(received, list(range(numItems)))
+
+        # An empty queue should time out
+        self.assertRaises(Empty, queue.get, timeout=0)
+        self.assertRaises(Empty, queue.get, timeout=0.1)
+
+        # A consumer waiting with no timeout should be woken by a put
+        timer = threading.Timer(0.1, queue.put, ("wake",))
+        timer.start()
+        try:
+            self.assertEqual(queue.get(), "wake")
+        finally:
+            timer.join()
+
 
 def _testGlobalMutexOrderingTask(scope, mutex, number):
     try:
@@ -0,0 +1,14 @@
+baseVersion = '8.2.0a1'
+cgcloudVersion = '1.6.0a1.dev393'
+version = '8.2.0a1-85303ba568a6ea143e4bc1c28d176f4a86a6e9d3'
+cacheTag = 'cache-local-py3.11'
+mainCacheTag = 'cache-master-py3.11'
+distVersion = '8.2.0a1'
+exactPython = 'python3.11'
+python = 'python3.11'
+dockerTag = '8.2.0a1-85303ba568a6ea143e4bc1c28d176f4a86a6e9d3-py3.11'
+currentCommit = '85303ba568a6ea143e4bc1c28d176f4a86a6e9d3'
+dockerRegistry = 'quay.io/ucsc_cgl'
+dockerName = 'toil'
+dirty = False
+cwltool_version = '3.1.20250110105449'